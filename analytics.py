@@ -0,0 +1,247 @@
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from models import db, UserBehavior
+
+VIEW, ADD_TO_CART, PURCHASE, OTHER = 1, 2, 4, 0
+ACTION_CODES = {'view': VIEW, 'add_to_cart': ADD_TO_CART, 'purchase': PURCHASE}
+
+# Column-oriented batch of events: session codes, action codes, product ids (0 = none)
+EventColumns = namedtuple('EventColumns', ['sessions', 'actions', 'products'])
+
+def load_events(start=None, end=None, chunk_size=100000, retention=None):
+    """
+    Read UserBehavior rows in [start, end) as numpy columns. Rows are fetched
+    as plain tuples in chunks and never materialized as ORM objects. With a
+    retention.BehaviorRetention, archived days are read as well.
+    """
+    # numpy is imported where it is used, not at module level, so workers
+    # that never build a funnel report don't pay for loading it
+    import numpy as np
+    if retention is not None:
+        chunks = retention.events(start, end, ('session_id', 'action', 'product_id'), chunk_size)
+    else:
+        query = select(UserBehavior.session_id, UserBehavior.action, UserBehavior.product_id)
+        if start is not None:
+            query = query.where(UserBehavior.timestamp >= start)
+        if end is not None:
+            query = query.where(UserBehavior.timestamp < end)
+        chunks = db.session.connection().execution_options(stream_results=True).execute(query).partitions(chunk_size)
+
+    session_codes = {}
+    sessions, actions, products = [], [], []
+    for chunk in chunks:
+        session_ids, action_names, product_ids = zip(*chunk)
+        sessions.append(np.fromiter((session_codes.setdefault(s, len(session_codes)) for s in session_ids),
+                                    dtype=np.int64, count=len(chunk)))
+        actions.append(np.fromiter((ACTION_CODES.get(a, OTHER) for a in action_names), dtype=np.uint8, count=len(chunk)))
+        products.append(np.fromiter((p or 0 for p in product_ids), dtype=np.int64, count=len(chunk)))
+    if not sessions:
+        return EventColumns(np.empty(0, np.int64), np.empty(0, np.uint8), np.empty(0, np.int64))
+    return EventColumns(np.concatenate(sessions), np.concatenate(actions), np.concatenate(products))
+
+def compute_funnel(events):
+    """
+    View -> add_to_cart -> purchase funnel, per-product conversion and cart
+    abandonment for a batch of EventColumns. Purchases are attributed to
+    every product the purchasing session added to its cart in the batch.
+    """
+    import numpy as np
+    sessions, actions, products = events
+    if len(sessions) == 0:
+        return _report(0, 0, 0, 0, {})
+
+    session_count = int(sessions.max()) + 1
+    session_flags = np.zeros(session_count, dtype=np.uint8)
+    for code in (VIEW, ADD_TO_CART, PURCHASE):
+        session_flags[np.bincount(sessions[actions == code], minlength=session_count) > 0] |= code
+    viewed = (session_flags & VIEW) != 0
+    carted = (session_flags & ADD_TO_CART) != 0
+    purchased = (session_flags & PURCHASE) != 0
+
+    per_product = {}
+    has_product = products != 0
+    product_ids = products[has_product]
+    if len(product_ids):
+        product_sessions = sessions[has_product]
+        product_actions = actions[has_product]
+        size = int(product_ids.max()) + 1
+        view_events = np.bincount(product_ids[product_actions == VIEW], minlength=size)
+        cart_events = np.bincount(product_ids[product_actions == ADD_TO_CART], minlength=size)
+
+        # Distinct (session, product) pairs per action
+        stride = size
+        view_pairs = _distinct(product_sessions[product_actions == VIEW] * stride + product_ids[product_actions == VIEW])
+        cart_pairs = _distinct(product_sessions[product_actions == ADD_TO_CART] * stride + product_ids[product_actions == ADD_TO_CART])
+        view_sessions = np.bincount(view_pairs % stride, minlength=size)
+        cart_sessions = np.bincount(cart_pairs % stride, minlength=size)
+        purchase_sessions = np.bincount(cart_pairs[purchased[cart_pairs // stride]] % stride, minlength=size)
+
+        for product_id in np.nonzero(view_events + cart_events)[0]:
+            per_product[int(product_id)] = {
+                'views': int(view_events[product_id]),
+                'add_to_carts': int(cart_events[product_id]),
+                'viewing_sessions': int(view_sessions[product_id]),
+                'carting_sessions': int(cart_sessions[product_id]),
+                'purchasing_sessions': int(purchase_sessions[product_id]),
+                'view_to_cart_rate': _rate(cart_sessions[product_id], view_sessions[product_id]),
+                'cart_to_purchase_rate': _rate(purchase_sessions[product_id], cart_sessions[product_id])
+            }
+
+    return _report(
+        int(np.count_nonzero(session_flags)),
+        int(np.count_nonzero(viewed)),
+        int(np.count_nonzero(carted)),
+        int(np.count_nonzero(carted & purchased)),
+        per_product,
+        viewed_then_carted=int(np.count_nonzero(viewed & carted)),
+        viewed_carted_purchased=int(np.count_nonzero(viewed & carted & purchased))
+    )
+
+def funnel_report(start=None, end=None, retention=None):
+    """Funnel over an arbitrary time window of stored (and, with `retention`, archived) events"""
+    return compute_funnel(load_events(start, end, retention=retention))
+
+def _distinct(keys):
+    """Sorted distinct values; a plain sort is much faster than np.unique's hashing for int keys"""
+    import numpy as np
+    keys = np.sort(keys)
+    if len(keys) == 0:
+        return keys
+    keep = np.empty(len(keys), dtype=bool)
+    keep[0] = True
+    np.not_equal(keys[1:], keys[:-1], out=keep[1:])
+    return keys[keep]
+
+def _rate(numerator, denominator):
+    return float(numerator) / float(denominator) if denominator else 0.0
+
+def _report(sessions, viewing, carting, carting_purchased, per_product, viewed_then_carted=0, viewed_carted_purchased=0):
+    return {
+        'sessions': sessions,
+        'funnel': {
+            'view': viewing,
+            'view_add_to_cart': viewed_then_carted,
+            'view_add_to_cart_purchase': viewed_carted_purchased
+        },
+        'carting_sessions': carting,
+        'purchasing_carting_sessions': carting_purchased,
+        'cart_abandonment_rate': _rate(carting - carting_purchased, carting),
+        'products': per_product
+    }
+
+class IncrementalFunnel:
+    """
+    Live funnel over the sessions active in the last `window`, updated as
+    events arrive instead of recomputed from the table. Each session keeps
+    its funnel flags and per-product event counts; when it has been idle for
+    longer than the window, or more than max_sessions are tracked, the oldest
+    session is dropped and its counts are subtracted again, so memory and
+    update cost stay bounded however long the process runs.
+    """
+
+    def __init__(self, window=timedelta(hours=24), max_sessions=100000):
+        self.window = window
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        # session_id -> _LiveSession, least recently active first
+        self.sessions = OrderedDict()
+        self.products = {}
+
+    def update(self, events):
+        """Apply event dicts with session_id, action, product_id and (optionally) timestamp"""
+        now = datetime.utcnow()
+        with self._lock:
+            for event in events:
+                self._apply(event['session_id'], ACTION_CODES.get(event['action'], OTHER), event.get('product_id'),
+                            event.get('timestamp') or now)
+            self._expire(now)
+
+    def _apply(self, session_id, action, product_id, timestamp):
+        if action == OTHER:
+            return
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = self.sessions[session_id] = _LiveSession()
+        else:
+            self.sessions.move_to_end(session_id)
+        session.last_seen = max(session.last_seen or timestamp, timestamp)
+        previous = session.flags
+        session.flags |= action
+
+        if product_id and action in (VIEW, ADD_TO_CART):
+            counts = self.products.setdefault(product_id, dict.fromkeys(_PRODUCT_COUNTERS, 0))
+            if action == VIEW:
+                counts['views'] += 1
+                if product_id not in session.views:
+                    counts['viewing_sessions'] += 1
+                session.views[product_id] = session.views.get(product_id, 0) + 1
+            else:
+                counts['add_to_carts'] += 1
+                if product_id not in session.carts:
+                    counts['carting_sessions'] += 1
+                    if session.flags & PURCHASE:
+                        counts['purchasing_sessions'] += 1
+                session.carts[product_id] = session.carts.get(product_id, 0) + 1
+        elif action == PURCHASE and not previous & PURCHASE:
+            for carted_product in session.carts:
+                self.products[carted_product]['purchasing_sessions'] += 1
+
+    def _expire(self, now):
+        cutoff = now - self.window
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if session.last_seen >= cutoff and len(self.sessions) <= self.max_sessions:
+                break
+            del self.sessions[session_id]
+            self._forget(session)
+
+    def _forget(self, session):
+        """Subtract an expired session's contribution from the product counters"""
+        for product_id, views in session.views.items():
+            self._decrement(product_id, views=views, viewing_sessions=1)
+        for product_id, carts in session.carts.items():
+            self._decrement(product_id, add_to_carts=carts, carting_sessions=1,
+                            purchasing_sessions=1 if session.flags & PURCHASE else 0)
+
+    def _decrement(self, product_id, **amounts):
+        counts = self.products[product_id]
+        for name, amount in amounts.items():
+            counts[name] -= amount
+        if not any(counts.values()):
+            del self.products[product_id]
+
+    def snapshot(self):
+        """Same shape as compute_funnel"""
+        with self._lock:
+            self._expire(datetime.utcnow())
+            flags = [session.flags for session in self.sessions.values()]
+            per_product = {}
+            for product_id, counts in self.products.items():
+                per_product[product_id] = dict(
+                    counts,
+                    view_to_cart_rate=_rate(counts['carting_sessions'], counts['viewing_sessions']),
+                    cart_to_purchase_rate=_rate(counts['purchasing_sessions'], counts['carting_sessions'])
+                )
+        return _report(
+            len(flags),
+            sum(1 for f in flags if f & VIEW),
+            sum(1 for f in flags if f & ADD_TO_CART),
+            sum(1 for f in flags if f & ADD_TO_CART and f & PURCHASE),
+            per_product,
+            viewed_then_carted=sum(1 for f in flags if f & VIEW and f & ADD_TO_CART),
+            viewed_carted_purchased=sum(1 for f in flags if f & VIEW and f & ADD_TO_CART and f & PURCHASE)
+        )
+
+_PRODUCT_COUNTERS = ('views', 'add_to_carts', 'viewing_sessions', 'carting_sessions', 'purchasing_sessions')
+
+class _LiveSession:
+    __slots__ = ('flags', 'last_seen', 'views', 'carts')
+
+    def __init__(self):
+        self.flags = 0
+        self.last_seen = None
+        # product_id -> event count
+        self.views = {}
+        self.carts = {}
@@ -1,36 +1,69 @@
+import atexit
 import os
 import json
-from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+import zlib
+from datetime import date, datetime, timedelta
+from flask import Flask, Response, abort, render_template, request, redirect, url_for, session, flash, jsonify
 from flask_bcrypt import Bcrypt
 from flask_session import Session
 from dotenv import load_dotenv
 from apscheduler.schedulers.background import BackgroundScheduler
 from models import db, User, Product, UserBehavior, MarketingMessage
-from journey_engine import JourneyEngine
+from journey_engine import InvalidEvent, JourneyEngine
+from migrations import upgrade_schema
+from catalog import ProductCatalog
+from cart_store import CartStore
+from recommender import Recommender
+from outbound_queue import OutboundQueue, OutboundWorker
+from storage import configure_database, install_sqlite_pragmas
+import metrics
+from analytics import IncrementalFunnel, funnel_report
+from retention import BehaviorRetention
 from gpt_generator import GPTGenerator
-from sms_sender import SMSSender
+import instrumentation
 
 load_dotenv()
+instrumentation.configure_logging()
+log = instrumentation.get_logger('app')
+
+ADMIN_USERS_PAGE = 50
+ADMIN_BEHAVIORS_PAGE = 100
+TRACK_BATCH_MAX_EVENTS = int(os.getenv('TRACK_BATCH_MAX_EVENTS', 500))
+TRACK_BATCH_MAX_BYTES = int(os.getenv('TRACK_BATCH_MAX_BYTES', 1024 * 1024))
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-change-this')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///ai_journey.db'
+configure_database(app)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SESSION_TYPE'] = 'filesystem'
 
 db.init_app(app)
+with app.app_context():
+    install_sqlite_pragmas(db.engine)
+    instrumentation.instrument_engine(db.engine)
+instrumentation.init_app(app)
 bcrypt = Bcrypt(app)
 Session(app)
 
 # Initialize services
-journey_engine = JourneyEngine()
+cart_store = CartStore()
+journey_engine = JourneyEngine(cart_store, abandon_after=timedelta(minutes=int(os.getenv('ABANDONED_CART_MINUTES', 5))))
 gpt_generator = GPTGenerator()
-sms_sender = SMSSender()
+catalog = ProductCatalog(ttl=float(os.getenv('CATALOG_TTL', 300)) or None,
+                         check_interval=float(os.getenv('CATALOG_CHECK_SECONDS', 5)) or None)
+recommender = Recommender(top_k=int(os.getenv('RECOMMENDATION_TOP_K', 10)),
+                          session_timeout=timedelta(hours=float(os.getenv('RECOMMENDATION_SESSION_HOURS', 24))))
+journey_engine.live_funnel = IncrementalFunnel(window=timedelta(hours=float(os.getenv('LIVE_FUNNEL_WINDOW_HOURS', 24))),
+                                               max_sessions=int(os.getenv('LIVE_FUNNEL_MAX_SESSIONS', 100000)))
+journey_engine.recommender = recommender
+journey_engine.catalog = catalog
+outbound_queue = journey_engine.enable_outbound(OutboundQueue())
+retention = BehaviorRetention()
+outbound_worker = None
 
 @app.route('/')
 def index():
-    products = Product.query.all()
+    products = catalog.all()
     return render_template('index.html', products=products)
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -79,26 +112,24 @@ def logout():
 
 @app.route('/product/<int:product_id>')
 def product_detail(product_id):
-    product = Product.query.get_or_404(product_id)
+    product = catalog.get(product_id)
+    if product is None:
+        abort(404)
     journey_engine.track_behavior(
         user_id=session.get('user_id'),
         session_id=session.get('session_id', 'anonymous'),
         action='view',
         product_id=product_id
     )
-    return render_template('product_detail.html', product=product)
+    in_cart = cart_store.get(session.get('session_id', 'anonymous'))
+    recommended = catalog.get_many(recommender.recommend([product_id, *in_cart], k=4))
+    return render_template('product_detail.html', product=product, recommendations=list(recommended.values()))
 
 @app.route('/add_to_cart', methods=['POST'])
 def add_to_cart():
     product_id = int(request.form['product_id'])
     quantity = int(request.form.get('quantity', 1))
-    if 'cart' not in session:
-        session['cart'] = {}
-    if str(product_id) in session['cart']:
-        session['cart'][str(product_id)] += quantity
-    else:
-        session['cart'][str(product_id)] = quantity
-    session.modified = True
+    cart_store.add_item(session.get('session_id', 'anonymous'), product_id, quantity, user_id=session.get('user_id'))
     journey_engine.track_behavior(
         user_id=session.get('user_id'),
         session_id=session.get('session_id', 'anonymous'),
@@ -113,37 +144,36 @@ def add_to_cart():
 def cart():
     cart_items = []
     total = 0
-    if 'cart' in session:
-        for product_id, quantity in session['cart'].items():
-            product = Product.query.get(int(product_id))
-            if product:
-                subtotal = product.price * quantity
-                cart_items.append({'product': product, 'quantity': quantity, 'subtotal': subtotal})
-                total += subtotal
+    items = cart_store.get(session.get('session_id', 'anonymous'))
+    products = catalog.get_many(items)
+    for product_id, quantity in items.items():
+        product = products.get(product_id)
+        if product:
+            subtotal = product.price * quantity
+            cart_items.append({'product': product, 'quantity': quantity, 'subtotal': subtotal})
+            total += subtotal
     return render_template('cart.html', cart_items=cart_items, total=total)
 
 @app.route('/remove_from_cart', methods=['POST'])
 def remove_from_cart():
-    product_id = request.form['product_id']
-    if 'cart' in session and product_id in session['cart']:
-        del session['cart'][product_id]
-        session.modified = True
+    product_id = int(request.form['product_id'])
+    if cart_store.remove_item(session.get('session_id', 'anonymous'), product_id, user_id=session.get('user_id')):
         journey_engine.track_behavior(
             user_id=session.get('user_id'),
             session_id=session.get('session_id', 'anonymous'),
             action='remove_from_cart',
-            product_id=int(product_id)
+            product_id=product_id
         )
         flash('Product removed from cart!', 'info')
     return redirect(url_for('cart'))
 
 @app.route('/checkout')
 def checkout():
-    if 'cart' not in session or not session['cart']:
+    session_id = session.get('session_id', 'anonymous')
+    if not cart_store.get(session_id):
         flash('Your cart is empty!', 'error')
         return redirect(url_for('index'))
-    session['cart'] = {}
-    session.modified = True
+    cart_store.clear(session_id)
     journey_engine.track_behavior(
         user_id=session.get('user_id'),
         session_id=session.get('session_id', 'anonymous'),
@@ -162,6 +192,24 @@ def chat():
     except Exception:
         return jsonify({'response': 'Sorry, I encountered an error. Please try again.', 'status': 'error'})
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    data = request.get_json(silent=True) or {}
+    message = data.get('message', '')
+
+    def events():
+        try:
+            for chunk in gpt_generator.generate_stream(message):
+                yield f"data: {json.dumps({'delta': chunk})}\n\n"
+        except Exception:
+            # The reply broke off part way; don't let the client take it as complete
+            yield f"data: {json.dumps({'error': 'The response was interrupted. Please try again.'})}\n\n"
+            return
+        yield f"data: {json.dumps({'done': True})}\n\n"
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/track_behavior', methods=['POST'])
 def track_behavior():
     try:
@@ -174,18 +222,164 @@ def track_behavior():
             data=json.dumps(data.get('data', {}))
         )
         return jsonify({'status': 'success'})
+    except InvalidEvent as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)})
 
+@app.route('/api/track_behavior/batch', methods=['POST'])
+def track_behavior_batch():
+    """Record an array of events in one transaction and return a status per event"""
+    events, error = read_event_batch()
+    if error is not None:
+        return error
+    try:
+        rejections = journey_engine.track_behaviors(
+            user_id=session.get('user_id'),
+            session_id=session.get('session_id', 'anonymous'),
+            events=events
+        )
+    except Exception as e:
+        db.session.rollback()
+        log.error("batch_track_failed", events=len(events), error=str(e))
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    accepted = rejections.count(None)
+    return jsonify({
+        'status': 'success' if accepted == len(events) else 'partial' if accepted else 'error',
+        'accepted': accepted,
+        'rejected': len(events) - accepted,
+        'results': [{'status': 'ok'} if reason is None else {'status': 'error', 'message': reason}
+                    for reason in rejections]
+    })
+
+def read_event_batch():
+    """
+    Decode a batch body: a JSON array of events or {"events": [...]},
+    optionally sent with Content-Encoding: gzip. Returns (events, None) or
+    (None, error response).
+    """
+    if (request.content_length or 0) > TRACK_BATCH_MAX_BYTES:
+        return None, batch_error('Request body is too large', 413)
+    # Without a Content-Length (chunked uploads) stop reading one byte past the limit
+    body = bytearray()
+    while len(body) <= TRACK_BATCH_MAX_BYTES:
+        chunk = request.stream.read(TRACK_BATCH_MAX_BYTES + 1 - len(body))
+        if not chunk:
+            break
+        body += chunk
+    if len(body) > TRACK_BATCH_MAX_BYTES:
+        return None, batch_error('Request body is too large', 413)
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        # Inflate at most one byte past the limit, so a small bomb cannot expand in memory
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = inflater.decompress(body, TRACK_BATCH_MAX_BYTES + 1)
+        except zlib.error as e:
+            return None, batch_error(f'Invalid gzip body: {e}', 400)
+    if len(body) > TRACK_BATCH_MAX_BYTES:
+        return None, batch_error('Request body is too large', 413)
+    try:
+        payload = json.loads(body)
+    except ValueError as e:
+        return None, batch_error(f'Invalid JSON: {e}', 400)
+    events = payload.get('events') if isinstance(payload, dict) else payload
+    if not isinstance(events, list):
+        return None, batch_error('Expected a JSON array of events', 400)
+    if len(events) > TRACK_BATCH_MAX_EVENTS:
+        return None, batch_error(f'At most {TRACK_BATCH_MAX_EVENTS} events per batch', 413)
+    return events, None
+
+def batch_error(message, status):
+    return jsonify({'status': 'error', 'message': message}), status
+
 @app.route('/admin')
 def admin_dashboard():
     if not session.get('user_id'):
         return redirect(url_for('login'))
-    users = User.query.all()
-    products = Product.query.all()
-    behaviors = UserBehavior.query.order_by(UserBehavior.timestamp.desc()).limit(100).all()
+    # Keyset pagination: pages are addressed by the last id seen, never by offset
+    users_after = request.args.get('users_after', 0, type=int)
+    users = User.query.filter(User.id > users_after).order_by(User.id).limit(ADMIN_USERS_PAGE + 1).all()
+    next_users_after = users[ADMIN_USERS_PAGE - 1].id if len(users) > ADMIN_USERS_PAGE else None
+    users = users[:ADMIN_USERS_PAGE]
+
+    behaviors_before = request.args.get('behaviors_before', type=int)
+    behavior_query = UserBehavior.query
+    if behaviors_before:
+        behavior_query = behavior_query.filter(UserBehavior.id < behaviors_before)
+    behaviors = behavior_query.order_by(UserBehavior.id.desc()).limit(ADMIN_BEHAVIORS_PAGE + 1).all()
+    next_behaviors_before = behaviors[ADMIN_BEHAVIORS_PAGE - 1].id if len(behaviors) > ADMIN_BEHAVIORS_PAGE else None
+    behaviors = behaviors[:ADMIN_BEHAVIORS_PAGE]
+
+    products = catalog.all()
     messages = MarketingMessage.query.order_by(MarketingMessage.sent_at.desc()).limit(50).all()
-    return render_template('admin.html', users=users, products=products, behaviors=behaviors, messages=messages)
+    summary = {
+        'behavior': metrics.behavior_summary(),
+        'messages': metrics.message_summary()
+    }
+    return render_template('admin.html', users=users, products=products, behaviors=behaviors, messages=messages,
+                           summary=summary, next_users_after=next_users_after,
+                           next_behaviors_before=next_behaviors_before)
+
+@app.route('/admin/summary')
+def admin_summary():
+    if not session.get('user_id'):
+        return redirect(url_for('login'))
+    hours = request.args.get('hours', 24, type=int)
+    days = request.args.get('days', 30, type=int)
+    return jsonify({'behavior': metrics.behavior_summary(hours=hours), 'messages': metrics.message_summary(days=days)})
+
+@app.route('/admin/funnel')
+def admin_funnel():
+    if not session.get('user_id'):
+        return redirect(url_for('login'))
+    if request.args.get('live'):
+        return jsonify(journey_engine.live_funnel.snapshot())
+    try:
+        start = datetime.fromisoformat(request.args['start']) if 'start' in request.args else None
+        end = datetime.fromisoformat(request.args['end']) if 'end' in request.args else None
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    if start is None and end is None:
+        start = datetime.utcnow() - timedelta(hours=request.args.get('hours', 24, type=int))
+    return jsonify(funnel_report(start, end, retention=retention))
+
+@app.route('/admin/behavior_daily')
+def admin_behavior_daily():
+    """Per-day event and session counts across archived and hot events"""
+    if not session.get('user_id'):
+        return redirect(url_for('login'))
+    try:
+        start = date.fromisoformat(request.args['start']) if 'start' in request.args else None
+        end = date.fromisoformat(request.args['end']) if 'end' in request.args else None
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    if start is None and end is None:
+        start = datetime.utcnow().date() - timedelta(days=request.args.get('days', 7, type=int) - 1)
+    return jsonify(retention.daily(start, end, action=request.args.get('action'),
+                                   product_id=request.args.get('product_id', type=int)))
+
+@app.route('/admin/retention_stats')
+def retention_stats():
+    if not session.get('user_id'):
+        return redirect(url_for('login'))
+    return jsonify(retention.get_stats())
+
+@app.route('/admin/ingest_stats')
+def ingest_stats():
+    if not session.get('user_id'):
+        return redirect(url_for('login'))
+    if not journey_engine.buffer:
+        return jsonify({'buffering': False})
+    return jsonify({'buffering': True, **journey_engine.buffer.get_stats()})
+
+@app.route('/admin/outbound_stats')
+def outbound_stats():
+    if not session.get('user_id'):
+        return redirect(url_for('login'))
+    stats = outbound_queue.get_stats()
+    if outbound_worker is not None:
+        stats['worker'] = {'name': outbound_worker.name, **outbound_worker.get_stats()}
+    return jsonify(stats)
 
 def create_sample_data():
     if Product.query.count() == 0:
@@ -201,11 +395,46 @@ def create_sample_data():
             product = Product(**product_data)
             db.session.add(product)
         db.session.commit()
-        print("Sample products created successfully!")
+        log.info("sample_products_created", count=len(sample_products))
+
+def setup_behavior_buffer():
+    if os.getenv('BEHAVIOR_BUFFERING', 'true').lower() != 'true':
+        return
+    journey_engine.enable_buffering(
+        app,
+        max_size=int(os.getenv('BEHAVIOR_QUEUE_SIZE', 10000)),
+        batch_size=int(os.getenv('BEHAVIOR_BATCH_SIZE', 500)),
+        flush_interval=float(os.getenv('BEHAVIOR_FLUSH_INTERVAL', 1.0))
+    )
+
+def setup_outbound_worker():
+    """Drain the outbound queue in this process; OUTBOUND_CONCURRENCY=0 leaves it to `python outbound_queue.py`"""
+    global outbound_worker
+    concurrency = int(os.getenv('OUTBOUND_CONCURRENCY', 4))
+    if concurrency <= 0:
+        return
+    outbound_worker = OutboundWorker(app, outbound_queue, concurrency=concurrency,
+                                     poll_interval=float(os.getenv('OUTBOUND_POLL_INTERVAL', 1.0)))
+    outbound_worker.start()
+    atexit.register(outbound_worker.stop)
+
+def in_app_context(name, func):
+    """Run a scheduler job inside the application context it needs for db.session, timing each run"""
+    def job():
+        with app.app_context():
+            func()
+    return instrumentation.timed_job(name, job)
 
-def setup_abandoned_cart_scheduler():
+def setup_scheduler():
     scheduler = BackgroundScheduler()
-    scheduler.add_job(func=journey_engine.check_abandoned_carts, trigger="interval", minutes=2, id='abandoned_cart_check')
+    scheduler.add_job(func=in_app_context('abandoned_cart_check', journey_engine.check_abandoned_carts), trigger="interval", minutes=2, id='abandoned_cart_check')
+    scheduler.add_job(func=in_app_context('recommendation_refresh', recommender.refresh), trigger="interval",
+                      seconds=int(os.getenv('RECOMMENDATION_REFRESH_SECONDS', 60)), id='recommendation_refresh')
+    retention_minutes = int(os.getenv('RETENTION_INTERVAL_MINUTES', 60))
+    # Nothing is archived or pruned until an archive directory is chosen
+    if retention_minutes > 0 and retention.archive.configured:
+        scheduler.add_job(func=in_app_context('behavior_retention', retention.run), trigger="interval",
+                          minutes=retention_minutes, id='behavior_retention')
     scheduler.start()
 
 @app.before_request
@@ -215,7 +444,10 @@ def set_session_id():
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        upgrade_schema()
         create_sample_data()
-        setup_abandoned_cart_scheduler()
+        setup_behavior_buffer()
+        setup_outbound_worker()
+        recommender.refresh()
+        setup_scheduler()
     app.run(debug=os.getenv('DEBUG', 'True').lower() == 'true', port=int(os.getenv('PORT', 5000)), host='0.0.0.0')
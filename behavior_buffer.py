@@ -0,0 +1,169 @@
+import queue
+import threading
+import time
+from sqlalchemy.exc import DataError, IntegrityError
+from models import db, UserBehavior
+import metrics
+from instrumentation import get_logger
+
+log = get_logger('behavior_buffer')
+
+class BehaviorBuffer:
+    """Write-behind buffer that batches behavior events into bulk inserts."""
+
+    def __init__(self, app, max_size=10000, batch_size=500, flush_interval=1.0, put_timeout=0.05,
+                 max_retries=3, retry_backoff=0.1):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._queue = queue.Queue(maxsize=max_size)
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        # Puts that passed the stop check but have not enqueued yet; stop waits for them
+        self._puts_in_flight = 0
+        self._puts_done = threading.Condition(self._lock)
+        self.stats = {
+            'enqueued': 0,
+            'rejected': 0,
+            'flushed': 0,
+            'failed': 0,
+            'retries': 0,
+            'batches': 0,
+            'last_batch_size': 0,
+            'max_batch_size': 0,
+            'last_flush_seconds': 0.0,
+            'max_flush_seconds': 0.0,
+            'total_flush_seconds': 0.0
+        }
+
+    def start(self):
+        """Start the background flusher thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='behavior-buffer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """Stop the flusher, writing out everything still queued"""
+        with self._lock:
+            self._stop_event.set()
+            self._puts_done.wait_for(lambda: self._puts_in_flight == 0, timeout)
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        # Anything enqueued after the flusher exited still gets written
+        self._drain()
+
+    def put(self, event):
+        """
+        Queue an event for the next batch. Returns False when the queue stays
+        full for longer than put_timeout so the caller can apply backpressure.
+        """
+        with self._lock:
+            if self._stop_event.is_set():
+                return False
+            self._puts_in_flight += 1
+        try:
+            self._queue.put(event, timeout=self.put_timeout)
+            accepted = True
+        except queue.Full:
+            accepted = False
+        with self._lock:
+            self._puts_in_flight -= 1
+            self.stats['enqueued' if accepted else 'rejected'] += 1
+            self._puts_done.notify_all()
+        return accepted
+
+    def get_stats(self):
+        """Return a snapshot of the buffer counters"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['queue_capacity'] = self._queue.maxsize
+        stats['avg_flush_seconds'] = stats['total_flush_seconds'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
+
+    def _increment(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            batch = self._collect_batch()
+            if batch:
+                self._flush(batch)
+        self._drain()
+
+    def _collect_batch(self):
+        """Block until batch_size events arrive or flush_interval elapses"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop_event.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self):
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._flush(batch)
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        with self.app.app_context():
+            stored = self._write(batch)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.stats['flushed'] += stored
+            self.stats['batches'] += 1
+            self.stats['last_batch_size'] = len(batch)
+            self.stats['max_batch_size'] = max(self.stats['max_batch_size'], len(batch))
+            self.stats['last_flush_seconds'] = elapsed
+            self.stats['max_flush_seconds'] = max(self.stats['max_flush_seconds'], elapsed)
+            self.stats['total_flush_seconds'] += elapsed
+
+    def _write(self, batch):
+        """Insert a batch, retrying transient errors; returns how many rows were stored"""
+        attempt = 0
+        while True:
+            try:
+                db.session.execute(UserBehavior.__table__.insert(), batch)
+                metrics.record_behaviors(batch)
+                db.session.commit()
+                return len(batch)
+            except (IntegrityError, DataError) as e:
+                db.session.rollback()
+                if len(batch) == 1:
+                    self._increment('failed')
+                    log.error("event_rejected", session_id=batch[0].get('session_id'), error=str(e.orig))
+                    return 0
+                # Retrying cannot help; split the batch so only the bad rows are lost
+                middle = len(batch) // 2
+                return self._write(batch[:middle]) + self._write(batch[middle:])
+            except Exception as e:
+                db.session.rollback()
+                if attempt >= self.max_retries:
+                    self._increment('failed', len(batch))
+                    log.error("flush_failed", events=len(batch), error=str(e))
+                    return 0
+                # Usually a transient "database is locked"; back off and retry
+                attempt += 1
+                self._increment('retries')
+                time.sleep(self.retry_backoff * (2 ** (attempt - 1)))
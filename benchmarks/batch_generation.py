@@ -0,0 +1,66 @@
+"""
+Marketing message generation throughput against a local FakeProvider.
+
+    python -m benchmarks.batch_generation --jobs 500 --latency 0.1
+"""
+import argparse
+import random
+import time
+from gpt_generator import GPTGenerator
+from llm_clients import FakeProvider
+
+def make_jobs(count, seed=3):
+    rng = random.Random(seed)
+    products = [f'Product {i}' for i in range(40)]
+    jobs = []
+    for index in range(count):
+        username = f'user{rng.randrange(count // 2 or 1)}'
+        kind = rng.choice(['abandoned_cart', 'purchase_confirmation', 'personalized_recommendation', 'product_interest'])
+        if kind == 'abandoned_cart':
+            jobs.append((kind, {'username': username, 'product_name': rng.choice(products)}))
+        elif kind == 'purchase_confirmation':
+            jobs.append((kind, {'username': username}))
+        elif kind == 'personalized_recommendation':
+            jobs.append((kind, {'username': username, 'viewed_products': rng.sample(products, 2),
+                                'recommended_products': rng.sample(products, 2)}))
+        else:
+            jobs.append((kind, {'product_name': rng.choice(products)}))
+    return jobs
+
+def generator(latency, max_batch_size=1, concurrency=16):
+    provider = FakeProvider(latency=latency, max_batch_size=max_batch_size,
+                            max_concurrency=concurrency, timeout=30, queue_timeout=30)
+    gen = GPTGenerator(provider=provider)
+    # Start every run cold; de-duplication happens inside the batch
+    gen.cache = None
+    return gen
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--jobs', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.1)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--sequential-sample', type=int, default=50)
+    args = parser.parse_args()
+
+    jobs = make_jobs(args.jobs)
+
+    sequential = generator(args.latency)
+    sample = jobs[:args.sequential_sample]
+    started = time.perf_counter()
+    for template, variables in sample:
+        sequential.generate_response(*sequential.build_prompt(template, variables))
+    elapsed = time.perf_counter() - started
+    print(f"sequential          {len(sample) / elapsed:8.1f} jobs/s")
+
+    for label, batch_size in [('concurrent', 1), ('concurrent+grouped', 10)]:
+        gen = generator(args.latency, max_batch_size=batch_size, concurrency=args.workers)
+        started = time.perf_counter()
+        results = gen.generate_batch(jobs, max_workers=args.workers)
+        elapsed = time.perf_counter() - started
+        failed = sum(1 for result in results if not result.ok)
+        print(f"{label:<19} {len(jobs) / elapsed:8.1f} jobs/s provider_requests={gen.get_stats()['provider_calls']} "
+              f"failed={failed}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Cart request latency: filesystem session cart vs. CartStore, plus the
+idle-cart lookup the abandoned-cart job runs on the store.
+
+    python -m benchmarks.cart_store --sessions 200 --requests 20
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from flask import session
+from flask_session import Session
+from models import db, Cart, CartItem
+from cart_store import CartStore
+from benchmarks.common import make_app, seed, percentile
+
+def build_app(cache_ttl):
+    app = make_app()
+    app.config['SECRET_KEY'] = 'bench'
+    app.config['SESSION_TYPE'] = 'filesystem'
+    app.config['SESSION_FILE_DIR'] = tempfile.mkdtemp(prefix='journey-sessions-')
+    Session(app)
+    store = CartStore(cache_ttl=cache_ttl)
+
+    # The original routes' cart handling, without the behavior tracking both share
+    @app.route('/session/add/<int:product_id>', methods=['POST'])
+    def session_add(product_id):
+        cart = session.setdefault('cart', {})
+        cart[str(product_id)] = cart.get(str(product_id), 0) + 1
+        session.modified = True
+        return ''
+
+    @app.route('/session/cart')
+    def session_cart():
+        return {'items': len(session.get('cart', {}))}
+
+    @app.route('/store/add/<int:product_id>', methods=['POST'])
+    def store_add(product_id):
+        store.add_item(session.setdefault('session_id', os.urandom(16).hex()), product_id)
+        return ''
+
+    @app.route('/store/cart')
+    def store_cart():
+        return {'items': len(store.get(session.get('session_id', 'anonymous')))}
+
+    return app, store
+
+def drive(app, prefix, sessions, requests, rng):
+    """Interleave add/view requests across sessions; return {route: [seconds]}"""
+    clients = [app.test_client() for _ in range(sessions)]
+    timings = {'add': [], 'view': []}
+    for _ in range(requests):
+        for client in clients:
+            started = time.perf_counter()
+            client.post(f'/{prefix}/add/{rng.randint(1, 50)}')
+            timings['add'].append(time.perf_counter() - started)
+            started = time.perf_counter()
+            client.get(f'/{prefix}/cart')
+            timings['view'].append(time.perf_counter() - started)
+    return timings
+
+def report(name, timings):
+    for route, values in timings.items():
+        print(f"{name:<18} {route:<5} p50={percentile(values, 50) * 1000:7.2f}ms "
+              f"p99={percentile(values, 99) * 1000:7.2f}ms n={len(values)}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sessions', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=20, help='add+view pairs per session')
+    parser.add_argument('--idle-carts', type=int, default=100000, help='carts for the idle-cart lookup')
+    args = parser.parse_args()
+
+    for name, prefix, cache_ttl in [('filesystem-session', 'session', 0), ('cart-store', 'store', 0),
+                                    ('cart-store/cache', 'store', 30)]:
+        app, store = build_app(cache_ttl)
+        report(name, drive(app, prefix, args.sessions, args.requests, random.Random(42)))
+
+    app, store = build_app(0)
+    with app.app_context():
+        seed(args.idle_carts, products=50, users=1)
+        now = datetime.utcnow()
+        db.session.execute(Cart.__table__.insert(), [
+            {'session_id': f'session-{i}', 'user_id': None, 'updated_at': now - timedelta(seconds=i % 3600)}
+            for i in range(args.idle_carts)
+        ])
+        db.session.execute(CartItem.__table__.insert(), [
+            {'session_id': f'session-{i}', 'product_id': i % 50 + 1, 'quantity': 1, 'updated_at': now}
+            for i in range(args.idle_carts)
+        ])
+        db.session.commit()
+        started = time.perf_counter()
+        idle = store.find_idle(now - timedelta(minutes=5), now - timedelta(minutes=10))
+        print(f"find_idle over {args.idle_carts} carts: {(time.perf_counter() - started) * 1000:.2f}ms "
+              f"({len(idle)} idle)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Chat tail latency under concurrent load against a local FakeProvider.
+
+Compares unguarded provider calls (every request waits for the provider, however
+slow) with the pooled client: concurrency limit, timeout and canned fallback.
+
+    python -m benchmarks.chat_latency --requests 400 --clients 32
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from gpt_generator import GPTGenerator
+from llm_clients import FakeProvider
+from response_cache import MemoryResponseCache
+from benchmarks.common import percentile
+
+def run(label, call, requests, clients):
+    def one(index):
+        started = time.perf_counter()
+        first_chunk = None
+        for _ in call(f"question {index}"):
+            if first_chunk is None:
+                first_chunk = time.perf_counter() - started
+        return first_chunk, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        results = list(executor.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+    firsts = [first for first, _ in results]
+    totals = [total for _, total in results]
+    print(f"{label:<10} {requests / elapsed:7.1f} req/s  "
+          f"ttfb p50={percentile(firsts, 50) * 1000:6.0f}ms p99={percentile(firsts, 99) * 1000:6.0f}ms  "
+          f"total p50={percentile(totals, 50) * 1000:6.0f}ms p95={percentile(totals, 95) * 1000:6.0f}ms "
+          f"p99={percentile(totals, 99) * 1000:6.0f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--clients', type=int, default=32, help='concurrent chat users')
+    parser.add_argument('--latency', type=float, default=0.3)
+    parser.add_argument('--slow-fraction', type=float, default=0.05)
+    parser.add_argument('--slow-latency', type=float, default=8.0)
+    parser.add_argument('--concurrency', type=int, default=16, help='provider concurrency limit')
+    parser.add_argument('--timeout', type=float, default=2.0)
+    args = parser.parse_args()
+
+    fake = dict(latency=args.latency, slow_fraction=args.slow_fraction, slow_latency=args.slow_latency, seed=7)
+
+    unguarded = FakeProvider(max_concurrency=args.clients, timeout=3600, queue_timeout=3600, **fake)
+    run('unguarded', lambda message: unguarded._stream('', message), args.requests, args.clients)
+
+    provider = FakeProvider(max_concurrency=args.concurrency, timeout=args.timeout, queue_timeout=args.timeout, **fake)
+    generator = GPTGenerator(cache=MemoryResponseCache(), provider=provider)
+    run('pooled', generator.generate_stream, args.requests, args.clients)
+    print(f"provider stats: {provider.get_stats()}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from flask import Flask
+from models import db, User, Product, UserBehavior
+from storage import engine_options, install_sqlite_pragmas
+
+ACTIONS = ['view', 'view', 'view', 'view', 'add_to_cart', 'remove_from_cart', 'purchase']
+
+def make_app(db_path=None, uri=None, pragmas=None):
+    """Create a bare Flask app bound to a scratch SQLite database (or the given URI)"""
+    if uri is None:
+        if db_path is None:
+            db_path = os.path.join(tempfile.mkdtemp(prefix='journey-bench-'), 'bench.db')
+        uri = f'sqlite:///{db_path}'
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(uri)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        install_sqlite_pragmas(db.engine, pragmas)
+        db.create_all()
+    return app
+
+def seed(rows, sessions=None, products=50, users=1000, window_minutes=60, batch_size=10000, seed_value=42):
+    """Insert synthetic users, products and behavior rows (needs an app context)"""
+    rng = random.Random(seed_value)
+    sessions = sessions or max(rows // 10, 1)
+    now = datetime.utcnow()
+
+    db.session.execute(User.__table__.insert(), [
+        {'username': f'user{i}', 'email': f'user{i}@example.com', 'phone': f'555000{i:04d}',
+         'password_hash': 'x', 'created_at': now}
+        for i in range(1, users + 1)
+    ])
+    db.session.execute(Product.__table__.insert(), [
+        {'name': f'Product {i}', 'description': 'Synthetic product', 'price': 10.0 + i,
+         'image_url': '', 'category': f'Category {i % 5}', 'created_at': now}
+        for i in range(1, products + 1)
+    ])
+
+    start = now - timedelta(minutes=window_minutes)
+    step = (window_minutes * 60.0) / rows
+    batch = []
+    for i in range(rows):
+        action = rng.choice(ACTIONS)
+        session_number = rng.randrange(sessions)
+        batch.append({
+            'user_id': (session_number % users) + 1 if session_number % 3 == 0 else None,
+            'session_id': f'session-{session_number}',
+            'action': action,
+            'product_id': None if action == 'purchase' else rng.randint(1, products),
+            'timestamp': start + timedelta(seconds=i * step),
+            'data': None
+        })
+        if len(batch) >= batch_size:
+            db.session.execute(UserBehavior.__table__.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(UserBehavior.__table__.insert(), batch)
+    db.session.commit()
+
+def timed(func, *args, repeat=3, **kwargs):
+    """Run func several times and return (best seconds, last result)"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
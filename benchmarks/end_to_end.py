@@ -0,0 +1,276 @@
+"""
+End-to-end load test of the real Flask app.
+
+Seeds a scratch database with synthetic users, products and UserBehavior rows,
+drives a weighted mix of routes through the test client from several threads
+with the LLM and Twilio clients stubbed out, then times check_abandoned_carts
+(and draining the reminders it queues) on its own. Results are JSON, so runs on
+different commits can be compared with --baseline.
+
+    python -m benchmarks.end_to_end --rows 1000000 --threads 8 --seconds 30 --output results.json
+    python -m benchmarks.end_to_end --rows 1000000 --baseline results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from benchmarks.common import seed, percentile
+
+# Relative weights of each scenario step in the mix
+DEFAULT_MIX = {
+    'browse': 20,
+    'product': 20,
+    'add_to_cart': 15,
+    'cart': 10,
+    'checkout': 5,
+    'track_behavior': 25,
+    'chat': 5
+}
+
+# The repository does not ship its templates; these stand in for them with the
+# same variables, so rendering cost stays in the measurement
+STUB_TEMPLATES = {
+    'index.html': "{% for p in products %}<a href='/product/{{ p.id }}'>{{ p.name }}</a> {{ p.price }}{% endfor %}",
+    'product_detail.html': "{{ product.name }} {{ product.description }} {{ product.price }}"
+                           "{% for r in recommendations %}<a href='/product/{{ r.id }}'>{{ r.name }}</a>{% endfor %}",
+    'cart.html': "{% for item in cart_items %}{{ item.product.name }} x{{ item.quantity }} = {{ item.subtotal }}"
+                 "{% endfor %} total {{ total }}",
+    'login.html': "<form method='post'></form>",
+    'register.html': "<form method='post'></form>",
+    'admin.html': "{{ users|length }} {{ behaviors|length }} {{ messages|length }}"
+}
+
+CHAT_MESSAGES = ['Where is my order?', 'Do you ship abroad?', 'Tell me about the headphones',
+                 'What is your return policy?', 'Any discounts today?']
+
+def load_app(db_path, args):
+    """Import the application against a scratch database with stubbed external clients"""
+    os.environ.update({
+        'DATABASE_URL': f'sqlite:///{db_path}',
+        'TWILIO_ACCOUNT_SID': '',
+        'TWILIO_AUTH_TOKEN': '',
+        'OPENAI_API_KEY': '',
+        'GEMINI_API_KEY': '',
+        'LOG_LEVEL': os.getenv('LOG_LEVEL', 'WARNING'),
+        'BEHAVIOR_BUFFERING': 'true' if args.buffering else 'false'
+    })
+    from jinja2 import ChoiceLoader, DictLoader
+    import app as application
+    from llm_clients import FakeProvider
+    from sms_sender import SMSSender, FakeTwilioClient, set_sms_sender
+
+    flask_app = application.app
+    flask_app.jinja_loader = ChoiceLoader([flask_app.jinja_loader, DictLoader(STUB_TEMPLATES)])
+    flask_app.config['SESSION_FILE_DIR'] = os.path.join(os.path.dirname(db_path), 'sessions')
+    application.gpt_generator.provider = FakeProvider(latency=args.llm_latency, seed=args.seed)
+    set_sms_sender(SMSSender(client=FakeTwilioClient(latency=args.sms_latency, seed=args.seed), rate_limit=1000))
+    return application
+
+def scenario_steps(mix):
+    steps, weights = zip(*mix.items())
+    return list(steps), list(weights)
+
+def run_user(client, rng, steps, weights, products, deadline, timings, errors):
+    """One simulated shopper issuing mixed requests until the deadline"""
+    client.get('/')
+    while time.perf_counter() < deadline:
+        step = rng.choices(steps, weights)[0]
+        product_id = rng.randint(1, products)
+        started = time.perf_counter()
+        if step == 'browse':
+            response = client.get('/')
+        elif step == 'product':
+            response = client.get(f'/product/{product_id}')
+        elif step == 'add_to_cart':
+            response = client.post('/add_to_cart', data={'product_id': product_id, 'quantity': 1})
+        elif step == 'cart':
+            response = client.get('/cart')
+        elif step == 'checkout':
+            response = client.get('/checkout')
+        elif step == 'track_behavior':
+            response = client.post('/api/track_behavior', json={
+                'action': rng.choice(['view', 'scroll', 'click']), 'product_id': product_id, 'data': {'page': 'index'}
+            })
+        else:
+            response = client.post('/api/chat', json={'message': rng.choice(CHAT_MESSAGES)})
+        elapsed = time.perf_counter() - started
+        failed = response.status_code >= 500
+        if not failed and response.is_json:
+            failed = (response.get_json() or {}).get('status') == 'error'
+        timings[step].append(elapsed)
+        if failed:
+            errors[step] += 1
+
+def drive(flask_app, args, mix):
+    steps, weights = scenario_steps(mix)
+    per_thread = [({step: [] for step in steps}, {step: 0 for step in steps}) for _ in range(args.threads)]
+    deadline = time.perf_counter() + args.seconds
+    threads = [
+        threading.Thread(target=run_user, args=(
+            flask_app.test_client(), random.Random(args.seed + number), steps, weights, args.products,
+            deadline, *per_thread[number]
+        ))
+        for number in range(args.threads)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    routes = {}
+    for step in steps:
+        values = [value for timings, _ in per_thread for value in timings[step]]
+        routes[step] = summarize(values, wall, errors=sum(errors[step] for _, errors in per_thread))
+    everything = [value for timings, _ in per_thread for values in timings.values() for value in values]
+    routes['all'] = summarize(everything, wall, errors=sum(sum(errors.values()) for _, errors in per_thread))
+    return routes, wall
+
+def summarize(values, wall, errors=0):
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'throughput_rps': round(len(values) / wall, 2) if wall else 0.0,
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p95_ms': round(percentile(values, 95) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'max_ms': round(max(values) * 1000, 3) if values else 0.0
+    }
+
+def time_background(application, args):
+    """check_abandoned_carts over seeded idle carts, then draining the reminders it queued"""
+    from models import db, Cart, CartItem, JobState
+    from journey_engine import ABANDONED_CART_CUTOFF
+    from outbound_queue import OutboundWorker
+
+    now = datetime.utcnow()
+    idle_at = now - application.journey_engine.abandon_after - timedelta(seconds=30)
+    db.session.execute(Cart.__table__.insert(), [
+        {'session_id': f'idle-{i}', 'user_id': i % args.users + 1, 'updated_at': idle_at}
+        for i in range(args.idle_carts)
+    ])
+    db.session.execute(CartItem.__table__.insert(), [
+        {'session_id': f'idle-{i}', 'product_id': i % args.products + 1, 'quantity': 1, 'updated_at': idle_at}
+        for i in range(args.idle_carts)
+    ])
+    db.session.commit()
+
+    results = {}
+    started = time.perf_counter()
+    application.recommender.refresh()
+    results['recommendation_refresh_ms'] = round((time.perf_counter() - started) * 1000, 3)
+
+    # Start from the window, not from the cutoff the scheduler persisted during the load phase
+    db.session.query(JobState).filter_by(name=ABANDONED_CART_CUTOFF).delete()
+    db.session.commit()
+    application.journey_engine.idle_cutoff = None
+    started = time.perf_counter()
+    application.journey_engine.check_abandoned_carts()
+    results['check_abandoned_carts_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    results['idle_carts'] = args.idle_carts
+
+    worker = OutboundWorker(application.app, application.outbound_queue, concurrency=args.sms_workers)
+    started = time.perf_counter()
+    while worker.run_once():
+        pass
+    elapsed = time.perf_counter() - started
+    results['reminder_drain_ms'] = round(elapsed * 1000, 3)
+    results['reminders'] = worker.get_stats()
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline):
+    """p95 and throughput change per route relative to a previous results file"""
+    changes = {}
+    for route, current in results['routes'].items():
+        previous = baseline.get('routes', {}).get(route)
+        if not previous or not previous['p95_ms'] or not previous['throughput_rps']:
+            continue
+        changes[route] = {
+            'p95_change_pct': round((current['p95_ms'] / previous['p95_ms'] - 1) * 100, 1),
+            'throughput_change_pct': round((current['throughput_rps'] / previous['throughput_rps'] - 1) * 100, 1)
+        }
+    return {'baseline_commit': baseline.get('meta', {}).get('commit'), 'routes': changes}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000, help='seeded UserBehavior rows')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8, help='concurrent simulated shoppers')
+    parser.add_argument('--seconds', type=float, default=30.0, help='length of the mixed-traffic phase')
+    parser.add_argument('--mix', type=json.loads, default=DEFAULT_MIX, help='JSON object of step weights')
+    parser.add_argument('--idle-carts', type=int, default=2000, help='abandoned carts for the background phase')
+    parser.add_argument('--llm-latency', type=float, default=0.05, help='stub LLM seconds per completion')
+    parser.add_argument('--sms-latency', type=float, default=0.01, help='stub Twilio seconds per message')
+    parser.add_argument('--sms-workers', type=int, default=8)
+    parser.add_argument('--no-buffering', dest='buffering', action='store_false',
+                        help='write tracked events inline instead of through the behavior buffer')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write the JSON results here as well as to stdout')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='journey-e2e-')
+    application = load_app(os.path.join(workdir, 'bench.db'), args)
+    from migrations import upgrade_schema
+
+    with application.app.app_context():
+        upgrade_schema()
+        started = time.perf_counter()
+        seed(args.rows, products=args.products, users=args.users, seed_value=args.seed)
+        seed_seconds = time.perf_counter() - started
+        application.setup_behavior_buffer()
+        application.recommender.refresh()
+
+    routes, wall = drive(application.app, args, args.mix)
+    if application.journey_engine.buffer:
+        application.journey_engine.buffer.stop()
+    with application.app.app_context():
+        background = time_background(application, args)
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'rows': args.rows,
+            'users': args.users,
+            'products': args.products,
+            'threads': args.threads,
+            'seconds': round(wall, 3),
+            'mix': args.mix,
+            'buffering': args.buffering,
+            'llm_latency': args.llm_latency,
+            'sms_latency': args.sms_latency,
+            'seed_seconds': round(seed_seconds, 3)
+        },
+        'routes': routes,
+        'background': background
+    }
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            results['comparison'] = compare(results, json.load(baseline))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output + '\n')
+    sys.stdout.write(output + '\n')
+
+if __name__ == '__main__':
+    main()
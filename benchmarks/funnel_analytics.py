@@ -0,0 +1,54 @@
+"""
+Funnel/conversion query latency.
+
+Vectorized compute over millions of in-memory synthetic events, plus the
+end-to-end window query (columnar load + compute) against SQLite compared with
+a per-row ORM loop.
+
+    python -m benchmarks.funnel_analytics --events 1000000 --events 5000000 --db-rows 200000
+"""
+import argparse
+import numpy as np
+from models import UserBehavior
+from analytics import VIEW, ADD_TO_CART, PURCHASE, EventColumns, compute_funnel, funnel_report
+from benchmarks.common import make_app, seed, timed
+
+def synthetic_columns(count, sessions, products, seed_value=11):
+    rng = np.random.default_rng(seed_value)
+    actions = rng.choice(np.array([VIEW, ADD_TO_CART, PURCHASE], dtype=np.uint8), size=count, p=[0.8, 0.15, 0.05])
+    product_ids = rng.integers(1, products + 1, size=count)
+    product_ids[actions == PURCHASE] = 0
+    return EventColumns(rng.integers(0, sessions, size=count), actions, product_ids)
+
+def orm_funnel():
+    """Naive reference: walk ORM objects one by one"""
+    flags = {}
+    for behavior in UserBehavior.query.all():
+        flags.setdefault(behavior.session_id, set()).add(behavior.action)
+    carting = [actions for actions in flags.values() if 'add_to_cart' in actions]
+    return len(flags), sum(1 for actions in carting if 'purchase' in actions)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--events', type=int, action='append', help='in-memory events (repeatable)')
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--db-rows', type=int, default=200000)
+    args = parser.parse_args()
+
+    for count in args.events or [1000000, 5000000]:
+        columns = synthetic_columns(count, sessions=max(count // 20, 1), products=args.products)
+        seconds, report = timed(compute_funnel, columns)
+        print(f"compute  events={count:>9} {seconds * 1000:8.1f}ms "
+              f"abandonment={report['cart_abandonment_rate']:.3f} products={len(report['products'])}")
+
+    if args.db_rows:
+        app = make_app()
+        with app.app_context():
+            seed(args.db_rows, products=args.products)
+            seconds, report = timed(funnel_report)
+            print(f"window   rows={args.db_rows:>9} columnar={seconds * 1000:8.1f}ms sessions={report['sessions']}")
+            seconds, (sessions, _) = timed(orm_funnel, repeat=1)
+            print(f"window   rows={args.db_rows:>9} orm     ={seconds * 1000:8.1f}ms sessions={sessions}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Cold-start budget: time and peak resident memory of `import app`.
+
+Each run imports the app in a fresh interpreter against a scratch database
+with no provider credentials, as a prefork worker or a test run would. The
+script exits non-zero when the median import time or peak RSS is over budget,
+or when a provider SDK that should only load on first use was imported.
+
+    python -m benchmarks.import_budget --runs 5 --max-seconds 1.0 --max-rss-mb 100
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from statistics import median
+
+# Imported on the first LLM call, SMS send, funnel report or recommendation
+# refresh, never at startup
+LAZY_MODULES = ['openai', 'google.generativeai', 'twilio.rest', 'requests', 'numpy', 'scipy']
+
+PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+import app
+seconds = time.perf_counter() - started
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+json.dump({
+    'seconds': seconds,
+    'rss_mb': peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024,
+    'loaded': [name for name in %r if name in sys.modules]
+}, sys.stdout)
+"""
+
+def probe(root, workdir):
+    env = dict(os.environ)
+    env.update({
+        'PYTHONPATH': root,
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'budget.db')}",
+        'TWILIO_ACCOUNT_SID': '',
+        'TWILIO_AUTH_TOKEN': '',
+        'OPENAI_API_KEY': '',
+        'GEMINI_API_KEY': '',
+        'LOG_LEVEL': 'OFF'
+    })
+    # Run from the scratch directory so the session store lands there too
+    output = subprocess.run([sys.executable, '-c', PROBE % (LAZY_MODULES,)], cwd=workdir, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, default=1.0, help='budget for the median import time')
+    parser.add_argument('--max-rss-mb', type=float, default=100.0, help='budget for the median peak RSS')
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    workdir = tempfile.mkdtemp(prefix='journey-import-')
+    runs = [probe(root, workdir) for _ in range(args.runs)]
+    seconds = median(run['seconds'] for run in runs)
+    rss_mb = median(run['rss_mb'] for run in runs)
+    loaded = sorted({name for run in runs for name in run['loaded']})
+
+    print(f"import app  median={seconds * 1000:.0f}ms (budget {args.max_seconds * 1000:.0f}ms)  "
+          f"peak_rss={rss_mb:.1f}MB (budget {args.max_rss_mb:.0f}MB)  runs={args.runs}")
+    failures = []
+    if seconds > args.max_seconds:
+        failures.append(f"import time {seconds:.3f}s is over {args.max_seconds}s")
+    if rss_mb > args.max_rss_mb:
+        failures.append(f"peak RSS {rss_mb:.1f}MB is over {args.max_rss_mb}MB")
+    if loaded:
+        failures.append(f"imported eagerly: {', '.join(loaded)}")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Concurrent track_behavior load test: sustained events/sec per storage configuration.
+
+    python -m benchmarks.ingest_load --threads 16 --seconds 10
+    DATABASE_URL=postgresql://... python -m benchmarks.ingest_load --server
+"""
+import argparse
+import threading
+import time
+from sqlalchemy.exc import OperationalError
+from models import db, UserBehavior
+from journey_engine import JourneyEngine
+from storage import database_uri
+from benchmarks.common import make_app
+
+SQLITE_CONFIGS = [
+    ('rollback-journal/FULL', {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'busy_timeout': 0}),
+    ('WAL/NORMAL', {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 5000}),
+]
+
+def drive(app, engine, threads, seconds):
+    """Run `threads` writers for `seconds`; return (events written, errors)"""
+    stop = threading.Event()
+    errors = []
+    issued = [0] * threads
+
+    def writer(number):
+        with app.app_context():
+            while not stop.is_set():
+                try:
+                    engine.track_behavior(None, f'load-{number}', 'view', product_id=1)
+                    issued[number] += 1
+                except Exception as e:
+                    db.session.rollback()
+                    errors.append(e)
+
+    workers = [threading.Thread(target=writer, args=(number,)) for number in range(threads)]
+    for worker in workers:
+        worker.start()
+    time.sleep(seconds)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    if engine.buffer:
+        engine.buffer.stop()
+    return sum(issued), errors
+
+def is_lock_error(error):
+    """SQLite busy/locked errors; the message may be wrapped, e.g. by autoflush"""
+    return isinstance(error, OperationalError) and 'locked' in str(error.orig)
+
+def run(label, app, engine, threads, seconds):
+    started = time.perf_counter()
+    issued, errors = drive(app, engine, threads, seconds)
+    elapsed = time.perf_counter() - started
+    with app.app_context():
+        stored = db.session.query(UserBehavior).count()
+    locked = sum(1 for error in errors if is_lock_error(error))
+    print(f"{label:<32} {stored / elapsed:9.0f} events/s stored={stored} issued={issued} "
+          f"errors={len(errors)} locked={locked}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--server', action='store_true', help='load the DATABASE_URL server database instead')
+    args = parser.parse_args()
+
+    if args.server:
+        configs = [(database_uri(), dict(uri=database_uri()))]
+    else:
+        configs = [(label, dict(pragmas=pragmas)) for label, pragmas in SQLITE_CONFIGS]
+
+    for label, options in configs:
+        for buffered in (False, True):
+            app = make_app(**options)
+            with app.app_context():
+                db.session.query(UserBehavior).delete()
+                db.session.commit()
+            engine = JourneyEngine()
+            if buffered:
+                engine.enable_buffering(app)
+            run(f"{label} {'buffered' if buffered else 'inline'}", app, engine, args.threads, args.seconds)
+
+if __name__ == '__main__':
+    main()
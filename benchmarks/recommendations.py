@@ -0,0 +1,81 @@
+"""
+Recommendation index build, incremental refresh and lookup latency.
+
+    python -m benchmarks.recommendations --rows 1000000 --products 500
+    python -m benchmarks.recommendations --rows 400000 --days 30 --session-hours 24
+
+With --days, events are spread over that many days in short sessions, so the
+one-event refresh shows the cost with closed sessions dropped from the index.
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from models import db, UserBehavior
+from recommender import Recommender
+from benchmarks.common import make_app, seed, timed, percentile
+
+def append_events(count, sessions, products, seed_value=7):
+    rng = random.Random(seed_value)
+    db.session.execute(UserBehavior.__table__.insert(), [
+        {'session_id': f'session-{rng.randrange(sessions)}', 'action': 'view', 'product_id': rng.randint(1, products)}
+        for _ in range(count)
+    ])
+    db.session.commit()
+
+def seed_history(rows, days, products, events_per_session=10, batch_size=10000, seed_value=42):
+    """Behavior rows over the last `days`, in consecutive sessions of a few events each"""
+    rng = random.Random(seed_value)
+    start = datetime.utcnow() - timedelta(days=days)
+    step = timedelta(days=days) / rows
+    batch = []
+    for i in range(rows):
+        batch.append({'session_id': f'history-{i // events_per_session}', 'action': rng.choice(['view', 'add_to_cart']),
+                      'product_id': rng.randint(1, products), 'timestamp': start + i * step})
+        if len(batch) >= batch_size:
+            db.session.execute(UserBehavior.__table__.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(UserBehavior.__table__.insert(), batch)
+    db.session.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--refresh-rows', type=int, default=10000, help='new events per incremental refresh')
+    parser.add_argument('--lookups', type=int, default=100000)
+    parser.add_argument('--days', type=float, help='spread events over this many days in short sessions')
+    parser.add_argument('--session-hours', type=float, default=24.0, help='idle time before a session is closed')
+    args = parser.parse_args()
+
+    app = make_app()
+    with app.app_context():
+        if args.days:
+            seed_history(args.rows, args.days, args.products)
+        else:
+            seed(args.rows, products=args.products)
+        recommender = Recommender(session_timeout=timedelta(hours=args.session_hours))
+        seconds, read = timed(recommender.rebuild, repeat=1)
+        print(f"rebuild  rows={read:>9} {seconds * 1000:9.1f}ms {recommender.get_stats()}")
+
+        append_events(1, sessions=1, products=args.products)
+        seconds, read = timed(recommender.refresh, repeat=1)
+        print(f"refresh  rows={read:>9} {seconds * 1000:9.1f}ms")
+
+        append_events(args.refresh_rows, sessions=max(args.rows // 10, 1), products=args.products)
+        seconds, read = timed(recommender.refresh, repeat=1)
+        print(f"refresh  rows={read:>9} {seconds * 1000:9.1f}ms")
+
+    rng = random.Random(3)
+    latencies = []
+    for _ in range(args.lookups):
+        session_products = [rng.randint(1, args.products) for _ in range(rng.randint(1, 5))]
+        started = time.perf_counter()
+        recommender.recommend(session_products, k=5)
+        latencies.append(time.perf_counter() - started)
+    print(f"lookup   p50={percentile(latencies, 50) * 1e6:.1f}us p99={percentile(latencies, 99) * 1e6:.1f}us "
+          f"n={len(latencies)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Behavior retention: archive throughput, compression, and how long concurrent
+event inserts stall while old days are pruned.
+
+    python -m benchmarks.retention --rows 1000000 --days 60 --hot-days 30
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from models import db, UserBehavior
+from retention import BehaviorArchive, BehaviorRetention
+from analytics import funnel_report
+from benchmarks.common import make_app, seed, percentile
+
+def insert_load(app, stop, latencies):
+    """One event insert at a time, as the ingest path does, until stopped"""
+    with app.app_context():
+        while not stop.is_set():
+            started = time.perf_counter()
+            db.session.execute(UserBehavior.__table__.insert(), [
+                {'session_id': 'live', 'action': 'view', 'product_id': 1, 'timestamp': datetime.utcnow()}
+            ])
+            db.session.commit()
+            latencies.append(time.perf_counter() - started)
+            time.sleep(0.001)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--days', type=int, default=60, help='days the seeded events span')
+    parser.add_argument('--hot-days', type=int, default=30)
+    parser.add_argument('--batch-size', type=int, default=1000, help='rows deleted per transaction')
+    parser.add_argument('--pause', type=float, default=0.0, help='seconds between delete batches')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='journey-retention-')
+    db_path = os.path.join(workdir, 'bench.db')
+    app = make_app(db_path)
+    retention = BehaviorRetention(archive=BehaviorArchive(os.path.join(workdir, 'archive')), hot_days=args.hot_days,
+                                  batch_size=args.batch_size, pause=args.pause)
+    with app.app_context():
+        seed(args.rows, window_minutes=args.days * 24 * 60)
+        database_bytes = os.path.getsize(db_path)
+        window = (datetime.utcnow() - timedelta(days=args.days), datetime.utcnow())
+        started = time.perf_counter()
+        hot_funnel = funnel_report(*window)
+        print(f"funnel   hot only          {(time.perf_counter() - started) * 1000:9.1f}ms")
+
+        stop = threading.Event()
+        latencies = []
+        writer = threading.Thread(target=insert_load, args=(app, stop, latencies))
+        writer.start()
+        started = time.perf_counter()
+        summary = retention.run()
+        elapsed = time.perf_counter() - started
+        stop.set()
+        writer.join()
+
+        archive_bytes = retention.archive.size()
+        print(f"run      days={summary['days']} archived={summary['archived']} in {elapsed:.2f}s "
+              f"({summary['archived'] / elapsed:,.0f} rows/s)")
+        print(f"archive  {archive_bytes / 1e6:.1f}MB gzip JSONL, {archive_bytes / max(summary['archived'], 1):.1f} bytes/row "
+              f"(database file {database_bytes / 1e6:.1f}MB before pruning)")
+        print(f"inserts  during run n={len(latencies)} p50={percentile(latencies, 50) * 1000:.2f}ms "
+              f"p99={percentile(latencies, 99) * 1000:.2f}ms max={max(latencies, default=0) * 1000:.2f}ms")
+
+        started = time.perf_counter()
+        merged_funnel = funnel_report(*window, retention=retention)
+        print(f"funnel   hot + archive     {(time.perf_counter() - started) * 1000:9.1f}ms "
+              f"sessions={merged_funnel['sessions']} (hot-only before: {hot_funnel['sessions']})")
+        started = time.perf_counter()
+        days = retention.daily(window[0].date())
+        print(f"daily    {len(days)} rows     {(time.perf_counter() - started) * 1000:9.1f}ms")
+        print(f"hot rows {db.session.query(func.count(UserBehavior.id)).scalar()}")
+
+if __name__ == '__main__':
+    main()
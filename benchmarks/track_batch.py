@@ -0,0 +1,101 @@
+"""
+Event ingest throughput: one event per POST /api/track_behavior versus
+arrays of events per POST /api/track_behavior/batch, plain and gzipped.
+
+    python -m benchmarks.track_batch --events 20000 --threads 4 --batch-sizes 10,50,200
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from benchmarks.common import seed, percentile
+from benchmarks.end_to_end import load_app
+
+ACTIONS = ['view', 'scroll', 'click', 'time_on_page']
+
+def make_events(rng, count, products):
+    return [{'action': rng.choice(ACTIONS), 'product_id': rng.randint(1, products),
+             'data': {'page': 'product', 'scroll_depth': rng.randint(0, 100)}} for _ in range(count)]
+
+def post_single(client, events):
+    for event in events:
+        response = client.post('/api/track_behavior', json=event)
+        assert response.get_json()['status'] == 'success', response.get_data(as_text=True)
+
+def post_batch(client, events, compress):
+    body = json.dumps(events).encode('utf-8')
+    headers = {'Content-Type': 'application/json'}
+    if compress:
+        body = gzip.compress(body)
+        headers['Content-Encoding'] = 'gzip'
+    response = client.post('/api/track_behavior/batch', data=body, headers=headers)
+    result = response.get_json()
+    assert result['accepted'] == len(events), result
+
+def run(flask_app, args, batch_size, compress):
+    """Send args.events events from args.threads clients; returns (events/sec, request latencies)"""
+    per_thread = args.events // args.threads
+    latencies = [[] for _ in range(args.threads)]
+
+    def client_loop(number):
+        client = flask_app.test_client()
+        rng = random.Random(args.seed + number)
+        events = make_events(rng, per_thread, args.products)
+        step = batch_size or 1
+        for offset in range(0, len(events), step):
+            chunk = events[offset:offset + step]
+            started = time.perf_counter()
+            if batch_size:
+                post_batch(client, chunk, compress)
+            else:
+                post_single(client, chunk)
+            latencies[number].append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=client_loop, args=(number,)) for number in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return per_thread * args.threads / elapsed, [value for values in latencies for value in values]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=20000, help='events sent per scenario')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--batch-sizes', default='10,50,200')
+    parser.add_argument('--no-buffering', dest='buffering', action='store_false',
+                        help='write single events inline instead of through the behavior buffer')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    # load_app's stubbed LLM and SMS clients are never called here
+    args.llm_latency = args.sms_latency = 0.0
+
+    workdir = tempfile.mkdtemp(prefix='journey-track-')
+    application = load_app(os.path.join(workdir, 'bench.db'), args)
+    from migrations import upgrade_schema
+    with application.app.app_context():
+        upgrade_schema()
+        seed(1000, products=args.products)
+        application.setup_behavior_buffer()
+
+    scenarios = [('single', 0, False)]
+    for size in (int(value) for value in args.batch_sizes.split(',')):
+        scenarios += [(f'batch {size}', size, False), (f'batch {size} gzip', size, True)]
+    baseline = None
+    for name, batch_size, compress in scenarios:
+        rate, latencies = run(application.app, args, batch_size, compress)
+        baseline = baseline or rate
+        print(f"{name:<16} {rate:>10,.0f} events/s  x{rate / baseline:5.1f}  "
+              f"request p50={percentile(latencies, 50) * 1000:7.2f}ms p99={percentile(latencies, 99) * 1000:7.2f}ms")
+    if application.journey_engine.buffer:
+        application.journey_engine.buffer.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from models import db, Cart, CartItem
+from storage import increment, upsert
+
+# One idle cart: the session, its user and the most recently added product
+AbandonedCart = namedtuple('AbandonedCart', ['session_id', 'user_id', 'product_id', 'updated_at'])
+
+class CartStore:
+    """
+    Carts persisted in the Cart/CartItem tables with a write-through
+    in-memory cache in front. Every change is a single-row atomic update and
+    bumps Cart.updated_at, which is indexed for idle-cart range queries.
+
+    The cache only sees this process's writes, so it is off unless a
+    cache_ttl is given (CART_CACHE_TTL); only enable it when a single process
+    serves all carts, otherwise another worker's change can be missed for up
+    to cache_ttl seconds.
+    """
+
+    def __init__(self, cache_size=None, cache_ttl=None):
+        self.cache_size = cache_size or int(os.getenv('CART_CACHE_SIZE', 10000))
+        self.cache_ttl = cache_ttl if cache_ttl is not None else float(os.getenv('CART_CACHE_TTL', 0))
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """Return {product_id: quantity} for the session's cart"""
+        cached = self._cached(session_id)
+        if cached is not None:
+            return dict(cached)
+        items = dict(db.session.query(CartItem.product_id, CartItem.quantity).filter(
+            CartItem.session_id == session_id
+        ).all())
+        self._remember(session_id, items)
+        return dict(items)
+
+    def add_item(self, session_id, product_id, quantity=1, user_id=None):
+        now = datetime.utcnow()
+        self._touch(session_id, user_id, now)
+        increment(db.session, CartItem, {'session_id': session_id, 'product_id': product_id},
+                  'quantity', quantity, values={'updated_at': now})
+        db.session.commit()
+        self._apply(session_id, lambda items: items.__setitem__(product_id, items.get(product_id, 0) + quantity))
+
+    def remove_item(self, session_id, product_id, user_id=None):
+        self._touch(session_id, user_id, datetime.utcnow())
+        removed = CartItem.query.filter_by(session_id=session_id, product_id=product_id).delete()
+        db.session.commit()
+        self._apply(session_id, lambda items: items.pop(product_id, None))
+        return removed > 0
+
+    def clear(self, session_id):
+        """Empty the cart, e.g. after checkout"""
+        CartItem.query.filter_by(session_id=session_id).delete()
+        Cart.query.filter_by(session_id=session_id).delete()
+        db.session.commit()
+        self._remember(session_id, {})
+
+    def find_idle(self, idle_before, modified_after=None, limit=None):
+        """
+        AbandonedCart records for non-empty carts last modified in
+        [modified_after, idle_before), oldest first. The carts come from a
+        range scan on Cart.updated_at and their items from primary-key lookups.
+        """
+        carts = self.idle_carts_query(idle_before, modified_after)
+        if limit:
+            carts = carts.limit(limit)
+        carts = carts.all()
+        if not carts:
+            return []
+        latest = {}
+        items = db.session.query(CartItem.session_id, CartItem.product_id, CartItem.updated_at).filter(
+            CartItem.session_id.in_([cart.session_id for cart in carts])
+        )
+        for session_id, product_id, added_at in items:
+            if session_id not in latest or added_at > latest[session_id][1]:
+                latest[session_id] = (product_id, added_at)
+        return [
+            AbandonedCart(cart.session_id, cart.user_id, latest[cart.session_id][0], cart.updated_at)
+            for cart in carts if cart.session_id in latest
+        ]
+
+    def idle_carts_query(self, idle_before, modified_after=None):
+        """Build the Cart range query behind find_idle"""
+        query = db.session.query(Cart.session_id, Cart.user_id, Cart.updated_at).filter(Cart.updated_at < idle_before)
+        if modified_after is not None:
+            query = query.filter(Cart.updated_at >= modified_after)
+        return query.order_by(Cart.updated_at)
+
+    def _touch(self, session_id, user_id, now):
+        values = {'updated_at': now}
+        if user_id:
+            values['user_id'] = user_id
+        upsert(db.session, Cart, {'session_id': session_id}, values)
+
+    def _cached(self, session_id):
+        if self.cache_ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._cache.get(session_id)
+            if entry is None:
+                return None
+            items, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._cache[session_id]
+                return None
+            self._cache.move_to_end(session_id)
+            return items
+
+    def _remember(self, session_id, items):
+        if self.cache_ttl <= 0:
+            return
+        with self._lock:
+            self._cache[session_id] = (dict(items), time.monotonic() + self.cache_ttl)
+            self._cache.move_to_end(session_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _apply(self, session_id, change):
+        """Mirror a committed change into the cached copy, if there is one"""
+        with self._lock:
+            entry = self._cache.get(session_id)
+            if entry is not None:
+                change(entry[0])
@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+from models import db, Product
+
+PRODUCT_FIELDS = ('id', 'name', 'description', 'price', 'image_url', 'category', 'created_at')
+
+# Immutable, so one instance can be shared by every request thread
+ProductRecord = namedtuple('ProductRecord', PRODUCT_FIELDS)
+
+class ProductCatalog:
+    """
+    Read-through in-memory copy of the Product table. The whole catalog is
+    loaded on first use and reloaded after any committed Product write.
+
+    Writes made by other processes are picked up by comparing a cheap version
+    (row count and highest id) at most every check_interval seconds, and by
+    reloading a snapshot older than ttl seconds, which also covers in-place
+    edits the version can't see. None disables either check.
+    """
+
+    def __init__(self, watch_writes=True, ttl=None, check_interval=None):
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._generation = 0
+        self._version = None
+        self._expires_at = None
+        self._check_at = None
+        if watch_writes:
+            event.listen(Session, 'before_flush', self._track_writes)
+            event.listen(Session, 'after_commit', self._after_commit)
+
+    def all(self):
+        """All products, ordered by id"""
+        return self._load()[0]
+
+    def get(self, product_id):
+        return self._load()[1].get(product_id)
+
+    def get_many(self, product_ids):
+        """Return {id: record} for the ids that exist"""
+        by_id = self._load()[1]
+        return {product_id: by_id[product_id] for product_id in product_ids if product_id in by_id}
+
+    def by_category(self, category):
+        return self._load()[2].get(category, ())
+
+    def categories(self):
+        return tuple(self._load()[2])
+
+    def invalidate(self):
+        """Drop the snapshot; the next read reloads it"""
+        with self._lock:
+            self._generation += 1
+            self._snapshot = None
+
+    def _load(self):
+        snapshot = self._snapshot
+        if snapshot is not None:
+            if self._is_current():
+                return snapshot
+            self.invalidate()
+        with self._lock:
+            if self._snapshot is not None:
+                return self._snapshot
+            generation = self._generation
+        # Read the version first so a write landing during the load is seen by the next check
+        version = self._read_version()
+        rows = db.session.query(*[getattr(Product, field) for field in PRODUCT_FIELDS]).order_by(Product.id).all()
+        records = tuple(ProductRecord(*row) for row in rows)
+        by_category = {}
+        for record in records:
+            by_category.setdefault(record.category, []).append(record)
+        snapshot = (
+            records,
+            MappingProxyType({record.id: record for record in records}),
+            MappingProxyType({category: tuple(items) for category, items in by_category.items()})
+        )
+        with self._lock:
+            # Don't publish data read before a concurrent invalidation
+            if self._generation == generation:
+                now = time.monotonic()
+                self._version = version
+                self._expires_at = None if self.ttl is None else now + self.ttl
+                self._check_at = None if self.check_interval is None else now + self.check_interval
+                self._snapshot = snapshot
+        return snapshot
+
+    def _is_current(self):
+        now = time.monotonic()
+        if self._expires_at is not None and now >= self._expires_at:
+            return False
+        if self._check_at is None or now < self._check_at:
+            return True
+        if self._read_version() != self._version:
+            return False
+        self._check_at = now + self.check_interval
+        return True
+
+    def _read_version(self):
+        return tuple(db.session.query(func.count(Product.id), func.max(Product.id)).one())
+
+    def _track_writes(self, session, flush_context, instances):
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if isinstance(obj, Product):
+                session.info['product_catalog_stale'] = True
+                return
+
+    def _after_commit(self, session):
+        if session.info.pop('product_catalog_stale', False):
+            self.invalidate()
@@ -1,59 +1,149 @@
 import os
-import openai
-import google.generativeai as genai
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from response_cache import build_response_cache, make_cache_key
+from llm_clients import OpenAIProvider, GeminiProvider
+from instrumentation import get_logger
 
 load_dotenv()
 
+log = get_logger('gpt')
+
+# template name -> (context, message)
+MESSAGE_TEMPLATES = {
+    "abandoned_cart": ("abandoned_cart", "Hey {username}, you left {product_name} in your cart! Don't miss out on this great product. Complete your purchase now and get it delivered to you soon!"),
+    "product_interest": ("product_interest", "I see you're interested in {product_name}. This is a great choice!"),
+    "purchase_confirmation": ("purchase_confirmation", "Thank you {username} for your purchase! We're processing your order and will send you updates soon."),
+    "personalized_recommendation": ("product_interest", "Based on your interest in {viewed_products}, you might like these products: {recommended_products}")
+}
+
 class GPTGenerator:
-    def __init__(self):
+    OPENAI_MODEL = "gpt-3.5-turbo"
+    GEMINI_MODEL = "gemini-pro"
+
+    def __init__(self, cache=None, provider=None):
         self.openai_key = os.getenv('OPENAI_API_KEY')
         self.gemini_key = os.getenv('GEMINI_API_KEY')
-        
+        self.cache = cache if cache is not None else build_response_cache()
+        self._provider = provider
+        self._provider_ready = provider is not None
+        self._provider_lock = threading.Lock()
+        # generate_batch updates the counters from its worker threads
+        self._stats_lock = threading.Lock()
+        self.stats = {'provider_calls': 0, 'provider_seconds': 0.0, 'fallbacks': 0}
+
+    @property
+    def provider(self):
+        """The configured provider, built on first use; None when no key is set"""
+        if not self._provider_ready:
+            with self._provider_lock:
+                if not self._provider_ready:
+                    self._provider = self._build_provider()
+                    self._provider_ready = True
+        return self._provider
+
+    @provider.setter
+    def provider(self, provider):
+        with self._provider_lock:
+            self._provider = provider
+            self._provider_ready = True
+    
+    def _build_provider(self):
+        """Create the shared client for the configured AI service"""
+        options = {
+            'max_concurrency': int(os.getenv('LLM_MAX_CONCURRENCY', 8)),
+            'timeout': float(os.getenv('LLM_TIMEOUT', 20)),
+            'queue_timeout': float(os.getenv('LLM_QUEUE_TIMEOUT', 2))
+        }
         if self.openai_key:
-            openai.api_key = self.openai_key
-        
+            return OpenAIProvider(self.openai_key, self.OPENAI_MODEL, **options)
         if self.gemini_key:
-            genai.configure(api_key=self.gemini_key)
+            return GeminiProvider(self.gemini_key, self.GEMINI_MODEL, **options)
+        return None
     
     def generate_response(self, message, context="customer_support"):
         """Generate a response using available AI service"""
+        if self.provider is None:
+            return self._generate_fallback_response(message, context)
+
+        key = self._cache_key(message, context)
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        started = time.perf_counter()
         try:
-            if self.openai_key:
-                return self._generate_with_openai(message, context)
-            elif self.gemini_key:
-                return self._generate_with_gemini(message, context)
-            else:
-                return self._generate_fallback_response(message, context)
+            response = self.provider.complete(self._get_system_prompt(context), message)
         except Exception as e:
-            print(f"Error generating response: {e}")
+            log.warning("llm_fallback", context=context, error=str(e))
+            self._count('fallbacks')
             return self._generate_fallback_response(message, context)
-    
-    def _generate_with_openai(self, message, context):
-        """Generate response using OpenAI GPT"""
-        system_prompt = self._get_system_prompt(context)
-        
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": message}
-            ],
-            max_tokens=150,
-            temperature=0.7
-        )
-        
-        return response.choices[0].message.content.strip()
-    
-    def _generate_with_gemini(self, message, context):
-        """Generate response using Google Gemini"""
-        model = genai.GenerativeModel('gemini-pro')
-        system_prompt = self._get_system_prompt(context)
-        
-        prompt = f"{system_prompt}\n\nUser: {message}\nAssistant:"
-        response = model.generate_content(prompt)
-        
-        return response.text.strip()
+        finally:
+            self._record_call(started)
+
+        if key:
+            self.cache.set(key, response)
+        return response
+
+    def generate_stream(self, message, context="customer_support"):
+        """
+        Yield the response in chunks. Falls back on timeout or overload before
+        the first chunk; an error after it is re-raised.
+        """
+        if self.provider is None:
+            yield self._generate_fallback_response(message, context)
+            return
+
+        key = self._cache_key(message, context)
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+
+        parts = []
+        started = time.perf_counter()
+        try:
+            for chunk in self.provider.stream(self._get_system_prompt(context), message):
+                parts.append(chunk)
+                yield chunk
+        except Exception as e:
+            if parts:
+                # Part of the answer is already out; the caller has to report the failure
+                log.warning("llm_stream_interrupted", context=context, chunks=len(parts), error=str(e))
+                raise
+            log.warning("llm_stream_fallback", context=context, error=str(e))
+            self._count('fallbacks')
+            yield self._generate_fallback_response(message, context)
+            return
+        finally:
+            self._record_call(started)
+
+        response = ''.join(parts).strip()
+        if key and response:
+            self.cache.set(key, response)
+
+    def get_stats(self):
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def _record_call(self, started):
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            self.stats['provider_calls'] += 1
+            self.stats['provider_seconds'] += elapsed
+
+    def _cache_key(self, message, context):
+        if self.cache is None:
+            return None
+        return make_cache_key(context, message, self.provider.model)
     
     def _generate_fallback_response(self, message, context):
         """Generate fallback response when no AI service is available"""
@@ -95,22 +185,130 @@ class GPTGenerator:
         
         return prompts.get(context, prompts["customer_support"])
     
+    def build_prompt(self, template, variables):
+        """Return (message, context) for a named message template"""
+        if template not in MESSAGE_TEMPLATES:
+            raise KeyError(f"Unknown message template: {template}")
+        context, text = MESSAGE_TEMPLATES[template]
+        values = {
+            name: ', '.join(value) if isinstance(value, (list, tuple)) else value
+            for name, value in variables.items()
+        }
+        return text.format(**values), context
+    
     def generate_abandoned_cart_message(self, username, product_name):
         """Generate personalized abandoned cart message"""
-        message = f"Hey {username}, you left {product_name} in your cart! Don't miss out on this great product. Complete your purchase now and get it delivered to you soon!"
-        return self.generate_response(message, "abandoned_cart")
+        message, context = self.build_prompt('abandoned_cart', {'username': username, 'product_name': product_name})
+        return self.generate_response(message, context)
     
     def generate_product_interest_message(self, product_name):
         """Generate message for product interest"""
-        message = f"I see you're interested in {product_name}. This is a great choice!"
-        return self.generate_response(message, "product_interest")
+        message, context = self.build_prompt('product_interest', {'product_name': product_name})
+        return self.generate_response(message, context)
     
     def generate_purchase_confirmation(self, username):
         """Generate purchase confirmation message"""
-        message = f"Thank you {username} for your purchase! We're processing your order and will send you updates soon."
-        return self.generate_response(message, "purchase_confirmation")
+        message, context = self.build_prompt('purchase_confirmation', {'username': username})
+        return self.generate_response(message, context)
     
     def generate_personalized_recommendation(self, username, viewed_products, recommended_products):
         """Generate personalized product recommendation"""
-        message = f"Based on your interest in {', '.join(viewed_products)}, you might like these products: {', '.join(recommended_products)}"
-        return self.generate_response(message, "product_interest") 
\ No newline at end of file
+        message, context = self.build_prompt('personalized_recommendation', {
+            'username': username,
+            'viewed_products': viewed_products,
+            'recommended_products': recommended_products
+        })
+        return self.generate_response(message, context)
+
+    def generate_batch(self, jobs, max_workers=8):
+        """
+        Generate messages for a list of (template, variables) jobs. Identical
+        prompts are generated once and provider calls run concurrently.
+        Prompts are only grouped into one request for providers with
+        max_batch_size above 1; OpenAI and Gemini take one prompt per request.
+        Returns one BatchResult per job, in job order.
+        """
+        results = [BatchResult(index, template) for index, (template, _) in enumerate(jobs)]
+        pending = {}
+        for result, (template, variables) in zip(results, jobs):
+            try:
+                message, context = self.build_prompt(template, variables)
+            except (KeyError, IndexError, ValueError) as e:
+                result.error = f"Invalid job: {e}"
+                continue
+            key = make_cache_key(context, message, self.provider.model if self.provider else '')
+            pending.setdefault(key, (message, context, []))[2].append(result)
+
+        if self.provider is None:
+            for message, context, waiting in pending.values():
+                self._resolve(waiting, self._generate_fallback_response(message, context))
+            return results
+
+        uncached = []
+        for key, (message, context, waiting) in pending.items():
+            cached = self.cache.get(key) if self.cache is not None else None
+            if cached is not None:
+                self._resolve(waiting, cached, cached=True)
+            else:
+                uncached.append((key, message, context, waiting))
+
+        # Group prompts sharing a system prompt into provider-sized requests
+        by_context = {}
+        for item in uncached:
+            by_context.setdefault(item[2], []).append(item)
+        size = max(1, self.provider.max_batch_size)
+        requests = [items[i:i + size] for items in by_context.values() for i in range(0, len(items), size)]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(self._run_batch_request, requests))
+        return results
+
+    def _run_batch_request(self, items):
+        context = items[0][2]
+        started = time.perf_counter()
+        try:
+            texts = self.provider.complete_many(self._get_system_prompt(context), [item[1] for item in items])
+        except Exception as e:
+            log.warning("llm_batch_fallback", context=context, size=len(items), error=str(e))
+            self._count('fallbacks', len(items))
+            for key, message, context, waiting in items:
+                self._resolve(waiting, self._generate_fallback_response(message, context), error=str(e))
+            return
+        finally:
+            self._record_call(started)
+        for (key, message, context, waiting), text in zip(items, texts):
+            if self.cache is not None:
+                self.cache.set(key, text)
+            self._resolve(waiting, text)
+
+    def _resolve(self, waiting, text, cached=False, error=None):
+        for result in waiting:
+            result.text = text
+            result.cached = cached
+            result.error = error
+            result.fallback = error is not None
+
+class BatchResult:
+    """Outcome of one generate_batch job"""
+
+    def __init__(self, index, template):
+        self.index = index
+        self.template = template
+        self.text = None
+        self.error = None
+        self.cached = False
+        self.fallback = False
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def to_dict(self):
+        return {
+            'index': self.index,
+            'template': self.template,
+            'text': self.text,
+            'error': self.error,
+            'cached': self.cached,
+            'fallback': self.fallback
+        }
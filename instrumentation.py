@@ -0,0 +1,289 @@
+import atexit
+import bisect
+import contextvars
+import hmac
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from flask import Response, g, request
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+class Metric:
+    """One metric family with labelled children, rendered in the Prometheus text format"""
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _labels(self, key, extra=None):
+        pairs = list(zip(self.labelnames, key)) + ([extra] if extra else [])
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._samples(items))
+        return lines
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self, items):
+        return [f"{self.name}{self._labels(key)} {value}" for key, value in items]
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block; `outcome` is 'error' if it raises"""
+        started = time.perf_counter()
+        outcome = 'ok'
+        try:
+            yield
+        except BaseException:
+            outcome = 'error'
+            raise
+        finally:
+            if 'outcome' in self.labelnames:
+                labels.setdefault('outcome', outcome)
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self, items):
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{self._labels(key, ('le', _format_bound(bound)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{self._labels(key, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {total}")
+            lines.append(f"{self.name}_count{self._labels(key)} {count}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_bound(bound):
+    return repr(float(bound))
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Request latency by route',
+                            ('route', 'method', 'status'))
+REQUEST_DB_QUERIES = Histogram('http_request_db_queries', 'Database queries issued per request',
+                               ('route',), buckets=COUNT_BUCKETS)
+REQUEST_DB_SECONDS = Histogram('http_request_db_seconds', 'Time spent in database queries per request', ('route',))
+DB_QUERIES = Counter('db_queries_total', 'Database queries, inside and outside requests')
+LLM_SECONDS = Histogram('llm_request_duration_seconds', 'LLM provider call latency',
+                        ('provider', 'operation', 'outcome'))
+SMS_SECONDS = Histogram('sms_send_duration_seconds', 'SMS provider call latency per attempt', ('outcome',))
+JOB_SECONDS = Histogram('scheduler_job_duration_seconds', 'Background job run time', ('job', 'outcome'))
+OUTBOUND_SECONDS = Histogram('outbound_job_duration_seconds', 'Outbound queue job run time', ('kind', 'outcome'))
+
+# [query count, query seconds] for the request running in this context
+_request_db = contextvars.ContextVar('request_db', default=None)
+
+def init_app(app):
+    """
+    Time every request. The registry is served at /metrics only when
+    METRICS_TOKEN is set, and Server-Timing headers, which expose database
+    timings to clients, are only added when SERVER_TIMING is true.
+    """
+    token = os.getenv('METRICS_TOKEN')
+    server_timing = os.getenv('SERVER_TIMING', 'false').lower() == 'true'
+
+    @app.before_request
+    def _start_request_timer():
+        g._instrumentation_started = time.perf_counter()
+        g._instrumentation_db = _request_db.set([0, 0.0])
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('_instrumentation_started', None)
+        reset = g.pop('_instrumentation_db', None)
+        if started is None:
+            return response
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        queries, db_seconds = _request_db.get() or (0, 0.0)
+        if reset is not None:
+            _request_db.reset(reset)
+        elapsed = time.perf_counter() - started
+        REQUEST_SECONDS.observe(elapsed, route=route, method=request.method, status=response.status_code)
+        REQUEST_DB_QUERIES.observe(queries, route=route)
+        REQUEST_DB_SECONDS.observe(db_seconds, route=route)
+        if server_timing:
+            response.headers['Server-Timing'] = f'app;dur={elapsed * 1000:.1f}, db;dur={db_seconds * 1000:.1f};desc="{queries} queries"'
+        return response
+
+    if not token:
+        return
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return Response('Unauthorized\n', status=401)
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+def instrument_engine(engine):
+    """Count and time every query on the engine, attributing it to the current request"""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['_query_started'].pop()
+        DB_QUERIES.inc()
+        totals = _request_db.get()
+        if totals is not None:
+            totals[0] += 1
+            totals[1] += elapsed
+
+def timed_job(name, func):
+    """Wrap a background job so its run time lands in scheduler_job_duration_seconds"""
+    def job(*args, **kwargs):
+        with JOB_SECONDS.time(job=name):
+            return func(*args, **kwargs)
+    job.__name__ = getattr(func, '__name__', name)
+    return job
+
+class SamplingFilter(logging.Filter):
+    """Keep a `rate` fraction of records below WARNING; warnings and errors always pass"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1.0 or random.random() < self.rate
+
+class StructuredFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, event and the call's fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = ' '.join(f'{key}={value}' for key, value in getattr(record, 'fields', {}).items())
+        return f"[{record.name}] {record.getMessage()}" + (f" {fields}" if fields else '')
+
+class StructuredLogger(logging.LoggerAdapter):
+    """log.info('event_name', key=value, ...); nothing is formatted when the level is disabled"""
+
+    def process(self, msg, kwargs):
+        reserved = {key: kwargs.pop(key) for key in ('exc_info', 'stack_info', 'stacklevel') if key in kwargs}
+        return msg, {**reserved, 'extra': {'fields': kwargs}}
+
+def get_logger(name):
+    return StructuredLogger(logging.getLogger(f'journey.{name}'), {})
+
+_listener = None
+
+def configure_logging(level=None, log_format=None, sample_rate=None):
+    """
+    Route the 'journey' loggers through a queue to a background writer so
+    logging never blocks on stdout. LOG_LEVEL (or 'off'), LOG_FORMAT
+    (json/text) and LOG_SAMPLE_RATE (0-1, info and debug only) tune it.
+    """
+    global _listener
+    level = (level or os.getenv('LOG_LEVEL', 'INFO')).upper()
+    log_format = log_format or os.getenv('LOG_FORMAT', 'text')
+    sample_rate = sample_rate if sample_rate is not None else float(os.getenv('LOG_SAMPLE_RATE', 1.0))
+
+    logger = logging.getLogger('journey')
+    logger.propagate = False
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    _stop_listener()
+    if level == 'OFF':
+        logger.setLevel(logging.CRITICAL + 1)
+        return logger
+    logger.setLevel(level)
+
+    output = logging.StreamHandler()
+    output.setFormatter(StructuredFormatter() if log_format == 'json' else TextFormatter())
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(SamplingFilter(sample_rate))
+    logger.addHandler(handler)
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+    return logger
+
+@atexit.register
+def _stop_listener():
+    """Flush queued records; runs at exit and on reconfiguration"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
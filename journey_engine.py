@@ -1,74 +1,286 @@
+import atexit
 import json
 from datetime import datetime, timedelta
-from models import db, UserBehavior, MarketingMessage, User, Product
-from sms_sender import SMSSender
+from models import db, UserBehavior, MarketingMessage, User, Product, JobState
+from sms_sender import get_sms_sender
+from behavior_buffer import BehaviorBuffer
+from cart_store import CartStore
+from outbound_queue import JobFailed
+from instrumentation import get_logger
+from storage import upsert
+import metrics
 
-sms_sender = SMSSender()
+log = get_logger('journey_engine')
+
+# How long a cart may have been idle beyond abandon_after and still get a
+# reminder when there is no earlier run to continue from (e.g. after a restart)
+ABANDONED_CART_WINDOW = timedelta(minutes=10)
+
+# JobState row holding the abandoned-cart high-water mark (idle_cutoff) as
+# whole epoch seconds, so a restarted process continues where the last run
+# stopped. retention.py keeps its own lease row in the same table.
+ABANDONED_CART_CUTOFF = 'abandoned_cart_cutoff'
+EPOCH = datetime(1970, 1, 1)
+
+# Length of the UserBehavior.action and session_id columns
+MAX_ACTION_LENGTH = 50
+MAX_SESSION_ID_LENGTH = 50
+
+class InvalidEvent(ValueError):
+    """A behavior event that cannot be stored; raised before it is queued"""
 
 class JourneyEngine:
+    def __init__(self, cart_store=None, abandon_after=timedelta(minutes=5)):
+        self.buffer = None
+        # Optional analytics.IncrementalFunnel fed with every tracked event
+        self.live_funnel = None
+        # Optional recommender.Recommender used to suggest a product in reminders
+        self.recommender = None
+        # Optional outbound_queue.OutboundQueue; reminders are sent inline without it
+        self.outbound = None
+        # Optional catalog.ProductCatalog; batched events for unknown products are rejected
+        self.catalog = None
+        self.cart_store = cart_store or CartStore()
+        self.abandon_after = abandon_after
+        # Carts that went idle before this were handled by an earlier run;
+        # loaded from JobState on the first run of the process
+        self.idle_cutoff = None
+
+    def enable_buffering(self, app, **options):
+        """
+        Switch track_behavior to write-behind mode. Events are queued and
+        bulk-inserted by a background flusher; the queue is flushed on exit.
+        """
+        if self.buffer is None:
+            self.buffer = BehaviorBuffer(app, **options)
+            self.buffer.start()
+            atexit.register(self.buffer.stop)
+        return self.buffer
+
+    def enable_outbound(self, queue):
+        """Queue reminder SMS on a durable outbound queue instead of sending them inline"""
+        self.outbound = queue
+        queue.register('sms', self.deliver_sms, on_finish=self.finish_sms)
+        return queue
+
+    def deliver_sms(self, payload):
+        """Outbound handler for 'sms' jobs: one send attempt"""
+        result = get_sms_sender().send_message(payload['to'], payload['body'])
+        if not result.success:
+            raise JobFailed(result.error, retryable=result.retryable)
+        return {'sid': result.sid}
+
+    def finish_sms(self, job, state, detail):
+        """Settle the MarketingMessage behind a sent or dead-lettered SMS job"""
+        message = db.session.get(MarketingMessage, job.payload.get('marketing_message_id'))
+        if message is not None:
+            self._settle_message(message, state)
+
+    def _settle_message(self, message, status):
+        if message.status == status:
+            return
+        metrics.record_message(message.message_type, message.status, sent_at=message.sent_at, count=-1)
+        metrics.record_message(message.message_type, status, sent_at=message.sent_at)
+        message.status = status
+
     def track_behavior(self, user_id, session_id, action, product_id=None, data=None):
         """
-        Record user behavior in the database.
+        Record user behavior in the database. Raises InvalidEvent, before
+        anything is queued, when a required field is missing or too long.
         """
-        behavior = UserBehavior(
-            user_id=user_id,
-            session_id=session_id,
-            action=action,
-            product_id=product_id,
-            data=data
-        )
+        if not isinstance(session_id, str) or not session_id or len(session_id) > MAX_SESSION_ID_LENGTH:
+            raise InvalidEvent("session_id is required")
+        error = self._invalid_action(action)
+        if error is not None:
+            raise InvalidEvent(error)
+        event = {
+            'user_id': user_id,
+            'session_id': session_id,
+            'action': action,
+            'product_id': product_id,
+            'timestamp': datetime.utcnow(),
+            'data': data
+        }
+        if self.live_funnel is not None:
+            self.live_funnel.update([event])
+        # When the buffer is full the event is written inline, which slows
+        # the caller down instead of dropping data.
+        if self.buffer and self.buffer.put(event):
+            return
+        behavior = UserBehavior(**event)
         db.session.add(behavior)
+        metrics.record_behaviors([event])
         db.session.commit()
-        print(f"[JourneyEngine] Tracked behavior: {action} for session: {session_id}")
+        log.debug("behavior_tracked", action=action, session_id=session_id)
+
+    def track_behaviors(self, user_id, session_id, events):
+        """
+        Record a batch of client events (dicts with action, product_id and
+        data) with one bulk insert in one transaction. The batch is validated
+        as a whole and the session and user are attached once. Returns one
+        entry per event, in order: None if it was recorded, otherwise the
+        reason it was rejected.
+        """
+        known_products = None
+        if self.catalog is not None:
+            known_products = self.catalog.get_many({
+                event.get('product_id') for event in events if isinstance(event, dict)
+                and isinstance(event.get('product_id'), int)
+            })
+        now = datetime.utcnow()
+        rows = []
+        results = []
+        for event in events:
+            error = self._invalid_event(event, known_products)
+            results.append(error)
+            if error is None:
+                rows.append({
+                    'user_id': user_id,
+                    'session_id': session_id,
+                    'action': event['action'],
+                    'product_id': event.get('product_id'),
+                    'timestamp': now,
+                    'data': json.dumps(event.get('data', {}))
+                })
+        if rows:
+            db.session.execute(UserBehavior.__table__.insert(), rows)
+            metrics.record_behaviors(rows)
+            db.session.commit()
+            if self.live_funnel is not None:
+                self.live_funnel.update(rows)
+        log.debug("behaviors_tracked", session_id=session_id, recorded=len(rows), rejected=len(events) - len(rows))
+        return results
+
+    def _invalid_event(self, event, known_products):
+        if not isinstance(event, dict):
+            return "event must be an object"
+        error = self._invalid_action(event.get('action'))
+        if error is not None:
+            return error
+        product_id = event.get('product_id')
+        if product_id is not None:
+            if not isinstance(product_id, int) or isinstance(product_id, bool):
+                return "product_id must be an integer"
+            if known_products is not None and product_id not in known_products:
+                return f"unknown product {product_id}"
+        return None
+
+    def _invalid_action(self, action):
+        if not isinstance(action, str) or not action:
+            return "action is required"
+        if len(action) > MAX_ACTION_LENGTH:
+            return f"action is longer than {MAX_ACTION_LENGTH} characters"
+        return None
 
     def check_abandoned_carts(self):
         """
-        Look for carts abandoned in the last 10 minutes and trigger reminders.
+        Send one reminder to every cart that has gone idle for abandon_after
+        since the last run. Idle carts come from a range query on the cart
+        store's last-modified index, so no events are replayed. The cutoff
+        is persisted after each run and picked up again after a restart.
         """
-        print("[JourneyEngine] Checking for abandoned carts...")
-        abandoned_threshold = datetime.utcnow() - timedelta(minutes=10)
-        # Find recent 'add_to_cart' behaviors
-        recent_behaviors = UserBehavior.query.filter(
-            UserBehavior.timestamp >= abandoned_threshold,
-            UserBehavior.action == 'add_to_cart'
-        ).all()
-
-        for behavior in recent_behaviors:
-            # Check if a purchase occurred after the add_to_cart
-            existing_purchase = UserBehavior.query.filter(
-                UserBehavior.session_id == behavior.session_id,
-                UserBehavior.action == 'purchase',
-                UserBehavior.timestamp > behavior.timestamp
-            ).first()
-            if not existing_purchase:
-                self.send_abandoned_cart_reminder(behavior)
-
-    def send_abandoned_cart_reminder(self, behavior):
+        now = datetime.utcnow()
+        if self.idle_cutoff is None:
+            self.idle_cutoff = self._load_idle_cutoff()
+        idle_before = now - self.abandon_after
+        idle_after = max(idle_before - ABANDONED_CART_WINDOW, self.idle_cutoff or datetime.min)
+        carts = self.cart_store.find_idle(idle_before, idle_after)
+        if carts:
+            self._send_due_reminders(carts)
+        self._save_idle_cutoff(idle_before)
+
+    def _load_idle_cutoff(self):
+        state = db.session.get(JobState, ABANDONED_CART_CUTOFF)
+        if state is None or state.value is None:
+            return None
+        return EPOCH + timedelta(seconds=state.value)
+
+    def _save_idle_cutoff(self, idle_before):
+        # Rounded down to the second: the next run may look at the same
+        # second again, and already-reminded sessions are skipped anyway
+        seconds = int((idle_before - EPOCH).total_seconds())
+        upsert(db.session, JobState, {'name': ABANDONED_CART_CUTOFF},
+               {'value': seconds, 'updated_at': datetime.utcnow()})
+        db.session.commit()
+        self.idle_cutoff = EPOCH + timedelta(seconds=seconds)
+
+    def _send_due_reminders(self, carts):
+        """Send reminders for idle carts, skipping sessions that were already reminded"""
+        reminded = {
+            row.session_id for row in db.session.query(MarketingMessage.session_id).filter(
+                MarketingMessage.session_id.in_([cart.session_id for cart in carts]),
+                MarketingMessage.message_type == 'sms'
+            ).distinct()
+        }
+        carts = [cart for cart in carts if cart.session_id not in reminded]
+        if not carts:
+            return
+
+        user_ids = {cart.user_id for cart in carts if cart.user_id}
+        users = {u.id: u for u in User.query.filter(User.id.in_(list(user_ids)))} if user_ids else {}
+        suggestions = {}
+        if self.recommender is not None:
+            for cart in carts:
+                suggestions[cart.session_id] = next(iter(self.recommender.recommend([cart.product_id], k=1)), None)
+        product_ids = [cart.product_id for cart in carts] + [p for p in suggestions.values() if p]
+        products = {p.id: p for p in Product.query.filter(Product.id.in_(product_ids))}
+        for cart in carts:
+            self.send_abandoned_cart_reminder(cart, user=users.get(cart.user_id), product=products.get(cart.product_id),
+                                              suggestion=products.get(suggestions.get(cart.session_id)))
+
+    def send_abandoned_cart_reminder(self, behavior, user=None, product=None, suggestion=None):
         """
-        Send a reminder SMS for an abandoned cart.
+        Send a reminder SMS for an abandoned cart. `behavior` is anything with
+        session_id, user_id and product_id (an 'add_to_cart' UserBehavior or a
+        cart_store.AbandonedCart). The user and product are looked up when the
+        caller has not already loaded them; `suggestion` is an optional
+        recommended product mentioned in the message.
         """
-        user = User.query.get(behavior.user_id) if behavior.user_id else None
-        product = Product.query.get(behavior.product_id)
+        if user is None and behavior.user_id:
+            user = User.query.get(behavior.user_id)
+        if product is None and behavior.product_id:
+            product = Product.query.get(behavior.product_id)
         if not product:
-            print("[JourneyEngine] No product found for abandoned cart behavior.")
+            log.warning("reminder_without_product", session_id=behavior.session_id, product_id=behavior.product_id)
             return
 
         message_content = f"Don't forget your {product.name}! Complete your purchase now."
+        if suggestion is not None and suggestion.id != product.id:
+            message_content += f" You might also like {suggestion.name}."
 
         if user and user.phone:
-            # Send SMS
-            sms_sender.send_sms(user.phone, message_content)
-            print(f"[JourneyEngine] Sent abandoned cart reminder SMS to {user.phone}: {message_content}")
-
-            # Record marketing message
+            # Recorded as pending first, so the session counts as reminded even if sending fails
             marketing_message = MarketingMessage(
                 user_id=user.id,
                 session_id=behavior.session_id,
                 message_type='sms',
                 content=message_content,
-                status='sent'
+                status='pending',
+                sent_at=datetime.utcnow()
             )
             db.session.add(marketing_message)
+            db.session.flush()
+            metrics.record_message('sms', 'pending', sent_at=marketing_message.sent_at)
+
+            if self.outbound is not None:
+                queued = self.outbound.enqueue('sms', {
+                    'to': user.phone,
+                    'body': message_content,
+                    'marketing_message_id': marketing_message.id
+                }, idempotency_key=f"abandoned_cart:{behavior.session_id}")
+                if not queued:
+                    # Another run already queued this session's reminder; drop our message and its rollup count
+                    db.session.rollback()
+                    log.info("reminder_skipped", session_id=behavior.session_id, reason="already queued")
+                    return
+                db.session.commit()
+                log.info("reminder_queued", session_id=behavior.session_id, message_id=marketing_message.id)
+                return
+
+            db.session.commit()
+            sent = get_sms_sender().send_sms(user.phone, message_content)
+            self._settle_message(marketing_message, 'sent' if sent else 'failed')
             db.session.commit()
+            log.info("reminder_sent" if sent else "reminder_failed", session_id=behavior.session_id, message_id=marketing_message.id)
         else:
-            print(f"[JourneyEngine] No phone number available for session {behavior.session_id}; cannot send SMS.")
+            log.info("reminder_skipped", session_id=behavior.session_id, reason="no phone number")
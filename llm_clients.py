@@ -0,0 +1,233 @@
+import abc
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from instrumentation import LLM_SECONDS
+
+class ProviderBusy(Exception):
+    """Raised when no concurrency slot frees up within the queue timeout"""
+
+class LLMProvider(abc.ABC):
+    """
+    One shared client per provider. Calls run on a small worker pool bounded
+    by a semaphore, so slow completions cannot tie up every request thread,
+    and callers stop waiting after `timeout` seconds. The SDK is imported and
+    its client built on the first call, so an unused provider costs nothing.
+    Subclasses implement _connect, _complete and _stream.
+    """
+    name = 'base'
+    # Prompts the provider accepts in a single request. The OpenAI chat and
+    # Gemini generate_content APIs take one, so complete_many sends one
+    # request per message for them; only FakeProvider groups prompts.
+    max_batch_size = 1
+
+    def __init__(self, model, max_concurrency=8, timeout=20.0, queue_timeout=2.0):
+        self.model = model
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=f'llm-{self.name}')
+        self._stats_lock = threading.Lock()
+        self.stats = {'calls': 0, 'timeouts': 0, 'rejected': 0, 'errors': 0}
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        """The SDK client, created on first use"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._connect()
+        return self._client
+
+    def complete(self, system_prompt, message):
+        """Return the full completion text"""
+        with LLM_SECONDS.time(provider=self.name, operation='complete'):
+            return self._result(self._submit(self._complete, system_prompt, message))
+
+    def complete_many(self, system_prompt, messages):
+        """Return one completion per message, in one request when the provider allows it"""
+        if self.max_batch_size <= 1 or len(messages) == 1:
+            return [self.complete(system_prompt, message) for message in messages]
+        with LLM_SECONDS.time(provider=self.name, operation='complete_many'):
+            return self._result(self._submit(self._complete_many, system_prompt, messages))
+
+    def _result(self, future):
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            self._count('timeouts')
+            raise TimeoutError(f"{self.name} did not answer within {self.timeout}s")
+        except Exception:
+            self._count('errors')
+            raise
+
+    def stream(self, system_prompt, message):
+        """Yield completion chunks as they arrive"""
+        chunks = queue.Queue()
+
+        def produce():
+            started = time.perf_counter()
+            try:
+                for chunk in self._stream(system_prompt, message):
+                    chunks.put(('chunk', chunk))
+                chunks.put(('done', None))
+                outcome = 'ok'
+            except Exception as e:
+                chunks.put(('error', e))
+                outcome = 'error'
+            LLM_SECONDS.observe(time.perf_counter() - started, provider=self.name, operation='stream', outcome=outcome)
+
+        self._submit(produce)
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                kind, value = chunks.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                self._count('timeouts')
+                raise TimeoutError(f"{self.name} stream did not finish within {self.timeout}s")
+            if kind == 'done':
+                return
+            if kind == 'error':
+                self._count('errors')
+                raise value
+            yield value
+
+    def get_stats(self):
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def _submit(self, func, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self._count('rejected')
+            raise ProviderBusy(f"{self.name} is at its concurrency limit")
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        # The slot is held until the call really finishes, even after the caller gave up
+        future.add_done_callback(lambda _: self._slots.release())
+        self._count('calls')
+        return future
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    @abc.abstractmethod
+    def _connect(self):
+        """Import the SDK and return its client"""
+
+    @abc.abstractmethod
+    def _complete(self, system_prompt, message):
+        """Return the completion text; runs on the worker pool"""
+
+    @abc.abstractmethod
+    def _stream(self, system_prompt, message):
+        """Yield completion chunks; runs on the worker pool"""
+
+    def _complete_many(self, system_prompt, messages):
+        """One request for several prompts; override when raising max_batch_size"""
+        return [self._complete(system_prompt, message) for message in messages]
+
+class OpenAIProvider(LLMProvider):
+    name = 'openai'
+
+    def __init__(self, api_key, model, **options):
+        super().__init__(model, **options)
+        self.api_key = api_key
+
+    def _connect(self):
+        import openai
+        return openai.OpenAI(api_key=self.api_key, timeout=self.timeout, max_retries=0)
+
+    def _messages(self, system_prompt, message):
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": message}
+        ]
+
+    def _complete(self, system_prompt, message):
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=self._messages(system_prompt, message),
+            max_tokens=150,
+            temperature=0.7
+        )
+        return response.choices[0].message.content.strip()
+
+    def _stream(self, system_prompt, message):
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=self._messages(system_prompt, message),
+            max_tokens=150,
+            temperature=0.7,
+            stream=True
+        )
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+class GeminiProvider(LLMProvider):
+    name = 'gemini'
+
+    def __init__(self, api_key, model, **options):
+        super().__init__(model, **options)
+        self.api_key = api_key
+
+    def _connect(self):
+        import google.generativeai as genai
+        genai.configure(api_key=self.api_key)
+        return genai.GenerativeModel(self.model)
+
+    def _prompt(self, system_prompt, message):
+        return f"{system_prompt}\n\nUser: {message}\nAssistant:"
+
+    def _complete(self, system_prompt, message):
+        return self.client.generate_content(self._prompt(system_prompt, message)).text.strip()
+
+    def _stream(self, system_prompt, message):
+        for chunk in self.client.generate_content(self._prompt(system_prompt, message), stream=True):
+            if chunk.text:
+                yield chunk.text
+
+class FakeProvider(LLMProvider):
+    """Local stand-in with configurable latency and a slow tail, for benchmarks"""
+    name = 'fake'
+
+    def __init__(self, model='fake-model', latency=0.2, slow_fraction=0.0, slow_latency=10.0,
+                 chunks=5, seed=None, max_batch_size=1, **options):
+        super().__init__(model, **options)
+        self.max_batch_size = max_batch_size
+        self.latency = latency
+        self.slow_fraction = slow_fraction
+        self.slow_latency = slow_latency
+        self.chunks = chunks
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    def _connect(self):
+        return None
+
+    def _pick_latency(self):
+        with self._random_lock:
+            slow = self._random.random() < self.slow_fraction
+        return self.slow_latency if slow else self.latency
+
+    def _complete(self, system_prompt, message):
+        time.sleep(self._pick_latency())
+        return f"Echo: {message}"
+
+    def _complete_many(self, system_prompt, messages):
+        time.sleep(self._pick_latency())
+        return [f"Echo: {message}" for message in messages]
+
+    def _stream(self, system_prompt, message):
+        delay = self._pick_latency() / self.chunks
+        for index in range(self.chunks):
+            time.sleep(delay)
+            yield f"part{index} "
@@ -0,0 +1,108 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert
+from models import db, UserBehavior, MarketingMessage, BehaviorRollup, MessageRollup
+from storage import increment, increment_many
+
+def record_behaviors(events):
+    """
+    Add behavior events (dicts with action, product_id and timestamp) to the
+    hourly rollup. Runs in the caller's transaction so counts commit with the events.
+    """
+    counts = Counter(
+        _behavior_key(event['action'], event.get('product_id'), event.get('timestamp')) for event in events
+    )
+    _write_behavior_counts(counts)
+
+def _behavior_key(action, product_id, timestamp):
+    hour = (timestamp or datetime.utcnow()).replace(minute=0, second=0, microsecond=0)
+    return hour, action, product_id or 0
+
+def _hour(timestamp, dialect):
+    """SQL truncating a timestamp to the hour, stored the way _behavior_key's hours are"""
+    if dialect == 'sqlite':
+        # SQLAlchemy keeps SQLite datetimes as text with microseconds; match it
+        # so backfilled hours share the unique key with those written by record_behaviors
+        return func.strftime('%Y-%m-%d %H:00:00.000000', timestamp)
+    return func.date_trunc('hour', timestamp)
+
+def _write_behavior_counts(counts):
+    increment_many(db.session, BehaviorRollup, ('hour', 'action', 'product_id'), 'count', [
+        {'hour': hour, 'action': action, 'product_id': product_id, 'count': count}
+        for (hour, action, product_id), count in sorted(counts.items())
+    ])
+
+def record_message(message_type, status, sent_at=None, count=1):
+    """
+    Add marketing messages to the daily rollup, in the caller's transaction.
+    A status change is a -1 for the old status and a +1 for the new one.
+    """
+    day = (sent_at or datetime.utcnow()).date()
+    _increment(MessageRollup, {'day': day, 'message_type': message_type, 'status': status}, count)
+
+def _increment(model, key, count):
+    increment(db.session, model, key, 'count', count)
+
+def behavior_summary(hours=24, top=5):
+    """Event totals per action and the most viewed products over the last `hours`"""
+    since = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=hours - 1)
+    by_action = dict(
+        db.session.query(BehaviorRollup.action, func.sum(BehaviorRollup.count)).filter(
+            BehaviorRollup.hour >= since
+        ).group_by(BehaviorRollup.action).all()
+    )
+    top_products = db.session.query(
+        BehaviorRollup.product_id, func.sum(BehaviorRollup.count).label('views')
+    ).filter(
+        BehaviorRollup.hour >= since,
+        BehaviorRollup.action == 'view',
+        BehaviorRollup.product_id != 0
+    ).group_by(BehaviorRollup.product_id).order_by(func.sum(BehaviorRollup.count).desc()).limit(top).all()
+    return {
+        'hours': hours,
+        'events_by_action': by_action,
+        'top_viewed_products': [(product_id, views) for product_id, views in top_products]
+    }
+
+def message_summary(days=30):
+    """Message counts per type and status over the last `days`"""
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    rows = db.session.query(
+        MessageRollup.message_type, MessageRollup.status, func.sum(MessageRollup.count)
+    ).filter(MessageRollup.day >= since).group_by(MessageRollup.message_type, MessageRollup.status).all()
+    summary = {}
+    for message_type, status, count in rows:
+        # Statuses move (pending -> sent), which can leave zero rows behind
+        if count:
+            summary.setdefault(message_type, {})[status] = count
+    return {'days': days, 'by_type': summary}
+
+def rebuild_rollups():
+    """
+    Recompute both rollups from the raw tables (backfill for existing
+    databases) with INSERT ... SELECT ... GROUP BY, so the events never leave
+    the database. Hours before the oldest stored event are left alone, since
+    their events may have been archived by retention.
+    """
+    oldest = db.session.query(func.min(UserBehavior.timestamp)).scalar()
+    rollups = db.session.query(BehaviorRollup)
+    if oldest is not None:
+        rollups = rollups.filter(BehaviorRollup.hour >= _behavior_key(None, None, oldest)[0])
+    rollups.delete(synchronize_session=False)
+    db.session.query(MessageRollup).delete()
+
+    dialect = db.session.get_bind().dialect.name
+    now = datetime.utcnow()
+    hour = _hour(func.coalesce(UserBehavior.timestamp, now), dialect)
+    product = func.coalesce(UserBehavior.product_id, 0)
+    behaviors = db.session.query(hour, UserBehavior.action, product, func.count()).group_by(
+        hour, UserBehavior.action, product
+    )
+    db.session.execute(insert(BehaviorRollup).from_select(['hour', 'action', 'product_id', 'count'], behaviors))
+
+    day = func.date(func.coalesce(MarketingMessage.sent_at, now))
+    messages = db.session.query(day, MarketingMessage.message_type, MarketingMessage.status, func.count()).group_by(
+        day, MarketingMessage.message_type, MarketingMessage.status
+    )
+    db.session.execute(insert(MessageRollup).from_select(['day', 'message_type', 'status', 'count'], messages))
+    db.session.commit()
@@ -0,0 +1,110 @@
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import Index, func, inspect
+from models import db, User, UserBehavior, MarketingMessage, BehaviorRollup
+import metrics
+from instrumentation import get_logger
+
+log = get_logger('migrations')
+
+# Indexes that were removed from the models; dropped where they still exist
+# so inserts stop paying for them
+RETIRED_INDEXES = {
+    'user_behavior': ['ix_user_behavior_action_timestamp', 'ix_user_behavior_session_action_timestamp'],
+}
+
+def upgrade_schema():
+    """
+    Bring an existing database up to date with the models. create_all only
+    creates missing tables, so indexes added to existing tables are created
+    here one by one, and retired ones are dropped.
+    """
+    db.create_all()
+    inspector = inspect(db.engine)
+    created = []
+    for table in db.metadata.sorted_tables:
+        existing = {item['name']: item['column_names'] for item in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=db.engine)
+                created.append(index.name)
+        for name in RETIRED_INDEXES.get(table.name, ()):
+            if name in existing:
+                Index(name, *[table.c[column] for column in existing[name]]).drop(bind=db.engine)
+                log.info("index_dropped", index=name)
+    for name in created:
+        log.info("index_created", index=name)
+
+    # Rollup tables added to a database that already has events start empty
+    if BehaviorRollup.query.first() is None and UserBehavior.query.first() is not None:
+        log.info("rollup_backfill_started")
+        metrics.rebuild_rollups()
+    return created
+
+# Hot queries whose SCAN walks the primary key in order and stops at the
+# LIMIT, so they read one page of rows, not the table
+PRIMARY_KEY_SCANS = {'admin_recent_behaviors'}
+
+def hot_queries():
+    """The queries that run on every request or scheduler tick"""
+    from cart_store import CartStore
+    from outbound_queue import OutboundQueue
+    from retention import BehaviorRetention
+    since = datetime.utcnow() - timedelta(minutes=10)
+    return {
+        'idle_carts': CartStore().idle_carts_query(datetime.utcnow(), since),
+        'outbound_claim': OutboundQueue().claimable_query(),
+        'retention_export': BehaviorRetention().export_query(since.date()),
+        # First page of the admin behaviors listing; later pages add the id < cursor filter
+        'admin_recent_behaviors': UserBehavior.query.order_by(UserBehavior.id.desc()).limit(100),
+        'admin_recent_messages': MarketingMessage.query.order_by(MarketingMessage.sent_at.desc()).limit(50),
+        'admin_users_page': User.query.filter(User.id > 0).order_by(User.id).limit(50),
+        'admin_behaviors_page': UserBehavior.query.filter(UserBehavior.id < 1000).order_by(UserBehavior.id.desc()).limit(100),
+        'behavior_summary': db.session.query(BehaviorRollup.action, func.sum(BehaviorRollup.count)).filter(
+            BehaviorRollup.hour >= since
+        ).group_by(BehaviorRollup.action),
+        'reminder_dedup': db.session.query(MarketingMessage.session_id).filter(
+            MarketingMessage.session_id.in_(['session']),
+            MarketingMessage.message_type == 'sms'
+        ).distinct()
+    }
+
+def explain(query):
+    """Return the SQLite query plan lines for a query"""
+    compiled = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'render_postcompile': True})
+    params = compiled.construct_params()
+    positional = tuple(params[name] for name in compiled.positiontup)
+    rows = db.session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", positional).fetchall()
+    return [row[-1] for row in rows]
+
+def find_full_scans():
+    """Return {query name: plan lines} for hot queries that scan a whole table"""
+    tables = set(db.metadata.tables)
+    offenders = {}
+    for name, query in hot_queries().items():
+        plan = explain(query)
+        if name in PRIMARY_KEY_SCANS and not any('TEMP B-TREE' in line for line in plan):
+            continue
+        for line in plan:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0] == 'SCAN' and parts[1] in tables and 'USING' not in parts:
+                offenders[name] = plan
+                break
+    return offenders
+
+if __name__ == '__main__':
+    from app import app
+    with app.app_context():
+        upgrade_schema()
+        if '--check-plans' in sys.argv:
+            if db.engine.dialect.name != 'sqlite':
+                print("[Migrations] Query plan check only supports SQLite")
+                sys.exit(0)
+            offenders = find_full_scans()
+            for name, plan in offenders.items():
+                print(f"[Migrations] Full table scan in {name}:")
+                for line in plan:
+                    print(f"    {line}")
+            if offenders:
+                sys.exit(1)
+            print("[Migrations] All hot queries use indexes")
@@ -37,6 +37,11 @@ class UserBehavior(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     data = db.Column(db.Text, nullable=True)
 
+    __table_args__ = (
+        # Admin dashboard "latest events" listing
+        db.Index('ix_user_behavior_timestamp', 'timestamp'),
+    )
+
 class MarketingMessage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
@@ -45,3 +50,93 @@ class MarketingMessage(db.Model):
     content = db.Column(db.Text, nullable=False)
     sent_at = db.Column(db.DateTime, default=datetime.utcnow)
     status = db.Column(db.String(20), default='pending')
+
+    __table_args__ = (
+        # Admin dashboard "latest messages" listing
+        db.Index('ix_marketing_message_sent_at', 'sent_at'),
+        # Reminder de-duplication per session
+        db.Index('ix_marketing_message_session_type', 'session_id', 'message_type'),
+    )
+
+class JobState(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class BehaviorRollup(db.Model):
+    """Behavior event counts per hour, action and product, maintained on write"""
+    id = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.DateTime, nullable=False)
+    action = db.Column(db.String(50), nullable=False)
+    # 0 for events without a product, so the unique key never contains NULL
+    product_id = db.Column(db.Integer, nullable=False, default=0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('hour', 'action', 'product_id', name='uq_behavior_rollup_key'),
+    )
+
+class BehaviorDailyRollup(db.Model):
+    """Behavior per day, action and product for days moved to the archive"""
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    action = db.Column(db.String(50), nullable=False)
+    # 0 for events without a product, as in BehaviorRollup
+    product_id = db.Column(db.Integer, nullable=False, default=0)
+    events = db.Column(db.Integer, nullable=False, default=0)
+    sessions = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('day', 'action', 'product_id', name='uq_behavior_daily_rollup_key'),
+    )
+
+class MessageRollup(db.Model):
+    """Marketing message counts per day, type and status, maintained on write"""
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    message_type = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('day', 'message_type', 'status', name='uq_message_rollup_key'),
+    )
+
+class Cart(db.Model):
+    """Server-side shopping cart, one per browser session"""
+    session_id = db.Column(db.String(50), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    # Last modification; range queries on it find idle (abandoned) carts
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+class CartItem(db.Model):
+    """Quantity of one product in a cart; updated in place with an upsert"""
+    session_id = db.Column(db.String(50), db.ForeignKey('cart.session_id'), primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class OutboundJob(db.Model):
+    """Durable outbound work (SMS sends, ...) drained by outbound_queue workers"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    # Enqueueing the same key twice is a no-op, so a job is never queued twice
+    idempotency_key = db.Column(db.String(200), nullable=False, unique=True)
+    payload = db.Column(db.Text, nullable=False)
+    # pending -> in_flight -> sent, or back to pending for a retry, or failed (dead letter)
+    state = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    available_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    lease_owner = db.Column(db.String(100), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    result = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # Claim scans: due pending jobs and expired leases
+        db.Index('ix_outbound_job_state_available', 'state', 'available_at'),
+        db.Index('ix_outbound_job_state_lease', 'state', 'lease_expires_at'),
+    )
@@ -0,0 +1,305 @@
+import json
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from sqlalchemy import and_, func, or_
+from models import db, OutboundJob
+from storage import insert_ignore
+from instrumentation import OUTBOUND_SECONDS, get_logger
+
+log = get_logger('outbound')
+
+PENDING, IN_FLIGHT, SENT, FAILED = 'pending', 'in_flight', 'sent', 'failed'
+
+# A job leased to one worker; lease_owner is the claim token every state change must match
+ClaimedJob = namedtuple('ClaimedJob', ['id', 'kind', 'payload', 'attempts', 'max_attempts', 'lease_owner'])
+
+class JobFailed(Exception):
+    """Raised by handlers. Retryable failures go back to pending with backoff."""
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+class OutboundQueue:
+    """
+    Durable job queue in the OutboundJob table. Jobs are claimed with a
+    conditional UPDATE that only matches due pending jobs or expired leases,
+    so concurrent workers in any number of processes never hold the same job.
+    Every later state change is guarded by the claim token: a worker whose
+    lease expired and was taken over cannot overwrite the new owner's result.
+    """
+
+    def __init__(self, lease_seconds=None, max_attempts=None, backoff=None, max_backoff=600.0):
+        self.lease_seconds = lease_seconds or int(os.getenv('OUTBOUND_LEASE_SECONDS', 60))
+        self.max_attempts = max_attempts or int(os.getenv('OUTBOUND_MAX_ATTEMPTS', 5))
+        self.backoff = backoff or float(os.getenv('OUTBOUND_BACKOFF_SECONDS', 5))
+        self.max_backoff = max_backoff
+        self.handlers = {}
+
+    def register(self, kind, handler, on_finish=None):
+        """
+        handler(payload) performs the job and returns a JSON-serializable
+        result or raises JobFailed. on_finish(job, state, detail) runs in the
+        transaction that marks the job sent or dead-lettered.
+        """
+        self.handlers[kind] = (handler, on_finish)
+
+    def enqueue(self, kind, payload, idempotency_key, max_attempts=None, available_at=None):
+        """
+        Add a job in the caller's transaction, so it commits together with the
+        row that asked for it. Returns False when the key was already queued.
+        """
+        return insert_ignore(db.session, OutboundJob, {'idempotency_key': idempotency_key}, {
+            'kind': kind,
+            'payload': json.dumps(payload),
+            'state': PENDING,
+            'attempts': 0,
+            'max_attempts': max_attempts or self.max_attempts,
+            'available_at': available_at or datetime.utcnow(),
+            'created_at': datetime.utcnow(),
+            'updated_at': datetime.utcnow()
+        })
+
+    def claim(self, owner, limit=10):
+        """Lease up to `limit` due jobs to `owner` and return them"""
+        now = datetime.utcnow()
+        claimable = self._claimable(now)
+        ids = [row.id for row in db.session.query(OutboundJob.id).filter(claimable).order_by(OutboundJob.id).limit(limit)]
+        if not ids:
+            db.session.rollback()
+            return []
+        token = f"{owner}:{uuid.uuid4().hex[:12]}"
+        db.session.query(OutboundJob).filter(OutboundJob.id.in_(ids), claimable).update({
+            OutboundJob.state: IN_FLIGHT,
+            OutboundJob.lease_owner: token,
+            OutboundJob.lease_expires_at: now + timedelta(seconds=self.lease_seconds),
+            OutboundJob.attempts: OutboundJob.attempts + 1,
+            OutboundJob.updated_at: now
+        }, synchronize_session=False)
+        db.session.commit()
+        rows = db.session.query(
+            OutboundJob.id, OutboundJob.kind, OutboundJob.payload, OutboundJob.attempts, OutboundJob.max_attempts
+        ).filter(OutboundJob.id.in_(ids), OutboundJob.lease_owner == token).order_by(OutboundJob.id).all()
+        return [ClaimedJob(row.id, row.kind, json.loads(row.payload), row.attempts, row.max_attempts, token)
+                for row in rows]
+
+    def renew(self, jobs):
+        """Extend the leases of jobs still being worked on; returns how many were still held"""
+        if not jobs:
+            return 0
+        now = datetime.utcnow()
+        renewed = db.session.query(OutboundJob).filter(
+            OutboundJob.id.in_([job.id for job in jobs]),
+            OutboundJob.lease_owner.in_({job.lease_owner for job in jobs}),
+            OutboundJob.state == IN_FLIGHT
+        ).update({
+            OutboundJob.lease_expires_at: now + timedelta(seconds=self.lease_seconds),
+            OutboundJob.updated_at: now
+        }, synchronize_session=False)
+        db.session.commit()
+        return renewed
+
+    def complete(self, job, result=None):
+        """Mark a leased job sent; returns False if the lease was lost"""
+        if not self._transition(job, {
+            OutboundJob.state: SENT,
+            OutboundJob.result: json.dumps(result) if result is not None else None,
+            OutboundJob.last_error: None
+        }):
+            return False
+        self._finish(job, SENT, result)
+        db.session.commit()
+        return True
+
+    def fail(self, job, error, retryable=True):
+        """
+        Record a failed attempt. The job is retried with exponential backoff
+        until max_attempts, then dead-lettered as 'failed'. Returns the new
+        state, or None if the lease was lost.
+        """
+        dead = not retryable or job.attempts >= job.max_attempts
+        values = {OutboundJob.last_error: str(error)[:1000]}
+        if dead:
+            values[OutboundJob.state] = FAILED
+        else:
+            delay = min(self.max_backoff, self.backoff * (2 ** (job.attempts - 1))) * (0.5 + random.random())
+            values[OutboundJob.state] = PENDING
+            values[OutboundJob.available_at] = datetime.utcnow() + timedelta(seconds=delay)
+        if not self._transition(job, values):
+            return None
+        if dead:
+            self._finish(job, FAILED, str(error))
+        db.session.commit()
+        return FAILED if dead else PENDING
+
+    def retry_dead(self, job_ids=None):
+        """Move dead-lettered jobs back to pending with a fresh attempt budget"""
+        query = db.session.query(OutboundJob).filter(OutboundJob.state == FAILED)
+        if job_ids is not None:
+            query = query.filter(OutboundJob.id.in_(job_ids))
+        count = query.update({
+            OutboundJob.state: PENDING,
+            OutboundJob.attempts: 0,
+            OutboundJob.available_at: datetime.utcnow()
+        }, synchronize_session=False)
+        db.session.commit()
+        return count
+
+    def get_stats(self):
+        """Job counts per state and the age of the oldest due job"""
+        counts = dict(db.session.query(OutboundJob.state, func.count(OutboundJob.id)).group_by(OutboundJob.state).all())
+        oldest = db.session.query(func.min(OutboundJob.available_at)).filter(OutboundJob.state == PENDING).scalar()
+        return {
+            'jobs_by_state': {state: counts.get(state, 0) for state in (PENDING, IN_FLIGHT, SENT, FAILED)},
+            'oldest_pending_seconds': max(0.0, (datetime.utcnow() - oldest).total_seconds()) if oldest else 0.0
+        }
+
+    def claimable_query(self):
+        """Build the candidate scan behind claim"""
+        return db.session.query(OutboundJob.id).filter(self._claimable(datetime.utcnow())).order_by(OutboundJob.id).limit(10)
+
+    def _claimable(self, now):
+        return or_(
+            and_(OutboundJob.state == PENDING, OutboundJob.available_at <= now),
+            and_(OutboundJob.state == IN_FLIGHT, OutboundJob.lease_expires_at < now)
+        )
+
+    def _transition(self, job, values):
+        values.update({
+            OutboundJob.lease_owner: None,
+            OutboundJob.lease_expires_at: None,
+            OutboundJob.updated_at: datetime.utcnow()
+        })
+        updated = db.session.query(OutboundJob).filter(
+            OutboundJob.id == job.id,
+            OutboundJob.lease_owner == job.lease_owner,
+            OutboundJob.state == IN_FLIGHT
+        ).update(values, synchronize_session=False)
+        if not updated:
+            db.session.rollback()
+            log.warning("lease_lost", job_id=job.id, owner=job.lease_owner)
+        return bool(updated)
+
+    def _finish(self, job, state, detail):
+        on_finish = self.handlers.get(job.kind, (None, None))[1]
+        if on_finish is not None:
+            on_finish(job, state, detail)
+
+class OutboundWorker:
+    """
+    Thread pool draining an OutboundQueue. Several workers, in one or many
+    processes, can drain the same table safely.
+    """
+
+    def __init__(self, app, queue, concurrency=4, poll_interval=1.0, name=None):
+        self.app = app
+        self.queue = queue
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='outbound')
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.stats = {'claimed': 0, 'sent': 0, 'retried': 0, 'dead_lettered': 0, 'lost_leases': 0}
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='outbound-worker', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=30.0):
+        """Stop claiming new jobs and wait for the ones in progress"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run_once(self):
+        """Claim one round of jobs, run them to completion and return how many ran"""
+        with self.app.app_context():
+            jobs = self.queue.claim(self.name, limit=self.concurrency)
+        self._increment('claimed', len(jobs))
+        running = {self._executor.submit(self._execute, job): job for job in jobs}
+        # Keep the leases of slow sends alive so no other worker claims and repeats them
+        while running:
+            done, _ = wait(running, timeout=self.queue.lease_seconds / 3)
+            for future in done:
+                del running[future]
+            if running:
+                self._renew(list(running.values()))
+        return len(jobs)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                ran = self.run_once()
+            except Exception as e:
+                log.error("claim_failed", worker=self.name, error=str(e))
+                ran = 0
+            if not ran:
+                self._stop_event.wait(self.poll_interval)
+
+    def _execute(self, job):
+        with self.app.app_context():
+            handler = self.queue.handlers.get(job.kind, (None, None))[0]
+            started = time.perf_counter()
+            try:
+                if handler is None:
+                    raise JobFailed(f"No handler registered for {job.kind!r}", retryable=False)
+                result = handler(job.payload)
+                OUTBOUND_SECONDS.observe(time.perf_counter() - started, kind=job.kind, outcome='ok')
+            except Exception as e:
+                OUTBOUND_SECONDS.observe(time.perf_counter() - started, kind=job.kind, outcome='error')
+                db.session.rollback()
+                state = self.queue.fail(job, e, retryable=getattr(e, 'retryable', True))
+                self._increment({PENDING: 'retried', FAILED: 'dead_lettered', None: 'lost_leases'}[state])
+                return
+            try:
+                completed = self.queue.complete(job, result)
+            except Exception as e:
+                # The job stays leased and is retried once the lease expires
+                db.session.rollback()
+                log.error("complete_failed", job_id=job.id, error=str(e))
+                completed = False
+            self._increment('sent' if completed else 'lost_leases')
+
+    def _renew(self, jobs):
+        try:
+            with self.app.app_context():
+                renewed = self.queue.renew(jobs)
+        except Exception as e:
+            log.error("renew_failed", worker=self.name, error=str(e))
+            return
+        if renewed < len(jobs):
+            log.warning("lease_lost", worker=self.name, jobs=len(jobs) - renewed)
+
+    def _increment(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+if __name__ == '__main__':
+    # Standalone worker process: python outbound_queue.py
+    from app import app, outbound_queue
+    worker = OutboundWorker(app, outbound_queue, concurrency=int(os.getenv('OUTBOUND_CONCURRENCY', 4)),
+                            poll_interval=float(os.getenv('OUTBOUND_POLL_INTERVAL', 1.0)))
+    log.info("worker_started", worker=worker.name)
+    worker.start()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        worker.stop()
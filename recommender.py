@@ -0,0 +1,216 @@
+import threading
+from datetime import timedelta
+from types import MappingProxyType
+from sqlalchemy import select
+from models import db, UserBehavior
+
+# How strongly each action ties a session to a product; a session's weight
+# for a product is the strongest action it took on it
+ACTION_WEIGHTS = {'view': 1.0, 'add_to_cart': 3.0, 'purchase': 5.0}
+
+class Recommender:
+    """
+    Item-item recommendations from co-occurrence in UserBehavior sessions.
+
+    A sparse session x product weight matrix S is folded into the product x
+    product co-occurrence matrix C = S.T @ S, and every product's top-K
+    neighbours by cosine similarity are precomputed. refresh() only reads
+    events newer than the last one seen and only updates the rows of C and
+    the neighbour lists they touch; lookups just read the precomputed index.
+    The index is per-process and lives in memory.
+
+    Sessions with no events for session_timeout (measured against the newest
+    event read) are closed: their co-occurrences stay in C but their rows
+    leave S, so memory and refresh cost follow the active sessions rather
+    than the whole history.
+    """
+
+    def __init__(self, top_k=10, chunk_size=100000, session_timeout=timedelta(hours=24)):
+        self.top_k = top_k
+        self.chunk_size = chunk_size
+        self.session_timeout = session_timeout
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._sessions = {}
+        # The arrays and matrices are allocated by the first refresh, so
+        # importing and constructing a Recommender does not load numpy/scipy
+        self._purchased = None
+        # Timestamp of each open session's latest event
+        self._last_seen = None
+        self._latest = None
+        self._closed = 0
+        self._weights = None
+        self._cooccurrence = None
+        self._last_id = 0
+        self._neighbours = MappingProxyType({})
+        self._popular = ()
+
+    def _allocate(self):
+        import numpy as np
+        from scipy import sparse
+        self._purchased = np.zeros(0, dtype=bool)
+        self._last_seen = np.zeros(0, dtype='datetime64[us]')
+        self._weights = sparse.csr_matrix((0, 0))
+        self._cooccurrence = sparse.csr_matrix((0, 0))
+
+    def similar(self, product_id, k=None):
+        """Product ids most often engaged with alongside product_id, best first"""
+        entry = self._neighbours.get(product_id)
+        if entry is None:
+            return []
+        return list(entry[0][:k or self.top_k])
+
+    def recommend(self, product_ids, k=None, exclude=()):
+        """
+        Top-k product ids for a session that engaged with product_ids, by
+        summed similarity. Sessions without known products get the most
+        engaged-with products instead.
+        """
+        k = k or self.top_k
+        neighbours = self._neighbours
+        skip = set(product_ids) | set(exclude)
+        scores = {}
+        for product_id in product_ids:
+            entry = neighbours.get(product_id)
+            if entry is None:
+                continue
+            for other, score in zip(*entry):
+                if other not in skip:
+                    scores[other] = scores.get(other, 0.0) + score
+        ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+        if len(ranked) < k:
+            taken = skip.union(ranked)
+            ranked.extend([product_id for product_id in self._popular if product_id not in taken][:k - len(ranked)])
+        return ranked
+
+    def refresh(self):
+        """Fold in events recorded since the last refresh; returns how many were read"""
+        with self._lock:
+            if self._weights is None:
+                self._allocate()
+            read = 0
+            query = select(UserBehavior.id, UserBehavior.session_id, UserBehavior.action, UserBehavior.product_id,
+                           UserBehavior.timestamp).where(
+                UserBehavior.id > self._last_id,
+                UserBehavior.action.in_(tuple(ACTION_WEIGHTS))
+            ).order_by(UserBehavior.id)
+            result = db.session.connection().execution_options(stream_results=True).execute(query)
+            for chunk in result.partitions(self.chunk_size):
+                self._apply(chunk)
+                self._close_idle_sessions()
+                self._last_id = chunk[-1][0]
+                read += len(chunk)
+            return read
+
+    def rebuild(self):
+        """Drop the index and rebuild it from every stored event"""
+        with self._lock:
+            self._reset()
+        return self.refresh()
+
+    def get_stats(self):
+        return {
+            'sessions': len(self._sessions),
+            'closed_sessions': self._closed,
+            'products': len(self._neighbours),
+            'pairs': int(self._cooccurrence.nnz) if self._cooccurrence is not None else 0,
+            'last_event_id': self._last_id
+        }
+
+    def _apply(self, events):
+        import numpy as np
+        from scipy import sparse
+        _, session_ids, actions, product_ids, timestamps = zip(*events)
+        rows = np.fromiter((self._sessions.setdefault(s, len(self._sessions)) for s in session_ids),
+                           dtype=np.int64, count=len(events))
+        weights = np.fromiter((ACTION_WEIGHTS[a] for a in actions), dtype=np.float64, count=len(events))
+        products = np.fromiter((p or 0 for p in product_ids), dtype=np.int64, count=len(events))
+        self._grow(len(self._sessions), int(products.max()) + 1)
+        self._latest = max(filter(None, (self._latest, *timestamps)), default=None)
+        # Events without a timestamp count as the newest one
+        np.maximum.at(self._last_seen, rows, np.array([t or self._latest for t in timestamps], dtype='datetime64[us]'))
+
+        # Purchases carry no product: they promote everything in the session's cart
+        purchase = weights == ACTION_WEIGHTS['purchase']
+        self._purchased[rows[purchase]] = True
+        has_product = products != 0
+        touched, local = np.unique(rows, return_inverse=True)
+
+        old = self._weights[touched]
+        new = old.maximum(_max_per_cell(local[has_product], products[has_product], weights[has_product],
+                                        (len(touched), self._weights.shape[1])))
+        carted = new.multiply(new >= ACTION_WEIGHTS['add_to_cart']).tocsr()
+        carted.data[:] = ACTION_WEIGHTS['purchase']
+        new = new.maximum(sparse.diags(self._purchased[touched].astype(np.float64)) @ carted).tocsr()
+
+        # Replace the touched session rows in S and adjust C by their difference
+        select_rows = sparse.csr_matrix((np.ones(len(touched)), (touched, np.arange(len(touched)))),
+                                        shape=(self._weights.shape[0], len(touched)))
+        self._weights = (self._weights + select_rows @ (new - old)).tocsr()
+        self._cooccurrence = (self._cooccurrence + new.T @ new - old.T @ old).tocsr()
+        self._cooccurrence.eliminate_zeros()
+
+        changed = np.union1d(old.indices, new.indices)
+        self._reindex(np.union1d(changed, self._cooccurrence[changed].indices))
+
+    def _grow(self, sessions, products):
+        import numpy as np
+        products = max(products, self._weights.shape[1])
+        if sessions > self._weights.shape[0] or products > self._weights.shape[1]:
+            self._weights.resize((sessions, products))
+            self._cooccurrence.resize((products, products))
+            self._purchased = np.concatenate([self._purchased, np.zeros(sessions - len(self._purchased), dtype=bool)])
+            self._last_seen = np.concatenate([self._last_seen, np.zeros(sessions - len(self._last_seen),
+                                                                        dtype='datetime64[us]')])
+
+    def _close_idle_sessions(self):
+        """Drop the S rows of sessions idle for session_timeout; C keeps what they contributed"""
+        import numpy as np
+        if self._latest is None or self.session_timeout is None:
+            return
+        keep = self._last_seen >= np.datetime64(self._latest - self.session_timeout, 'us')
+        if keep.all():
+            return
+        new_rows = np.cumsum(keep) - 1
+        self._sessions = {session_id: int(new_rows[row]) for session_id, row in self._sessions.items() if keep[row]}
+        self._weights = self._weights[keep]
+        self._purchased = self._purchased[keep]
+        self._last_seen = self._last_seen[keep]
+        self._closed += int(len(keep) - keep.sum())
+
+    def _reindex(self, product_ids):
+        """Recompute the neighbour lists of product_ids and publish a new index"""
+        import numpy as np
+        matrix = self._cooccurrence
+        norms = np.sqrt(matrix.diagonal())
+        neighbours = dict(self._neighbours)
+        for product_id in product_ids.tolist():
+            start, end = matrix.indptr[product_id], matrix.indptr[product_id + 1]
+            others = matrix.indices[start:end]
+            scores = matrix.data[start:end] / (norms[product_id] * norms[others])
+            keep = others != product_id
+            others, scores = others[keep], scores[keep]
+            if len(others) > self.top_k:
+                best = np.argpartition(-scores, self.top_k)[:self.top_k]
+                others, scores = others[best], scores[best]
+            order = np.argsort(-scores, kind='stable')
+            if len(order) or norms[product_id]:
+                neighbours[product_id] = (tuple(others[order].tolist()), tuple(scores[order].tolist()))
+        popularity = matrix.diagonal()
+        popular = np.argsort(-popularity, kind='stable')[:self.top_k]
+        self._popular = tuple(popular[popularity[popular] > 0].tolist())
+        self._neighbours = MappingProxyType(neighbours)
+
+def _max_per_cell(rows, columns, values, shape):
+    """Sparse matrix holding the largest value given for each (row, column)"""
+    import numpy as np
+    from scipy import sparse
+    keys = rows * shape[1] + columns
+    order = np.lexsort((values, keys))
+    keys, values = keys[order], values[order]
+    last = np.ones(len(keys), dtype=bool)
+    last[:-1] = keys[1:] != keys[:-1]
+    keys, values = keys[last], values[last]
+    return sparse.csr_matrix((values, (keys // shape[1], keys % shape[1])), shape=shape)
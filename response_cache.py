@@ -0,0 +1,145 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+def normalize_message(message):
+    """Collapse whitespace and case so trivially different prompts share an entry"""
+    return ' '.join((message or '').split()).casefold()
+
+def make_cache_key(context, message, model):
+    raw = '\x1f'.join([model or '', context or '', normalize_message(message)])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+class ResponseCache:
+    """Base class keeping hit/miss/latency counters for cache backends"""
+
+    def __init__(self, max_entries=1000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'sets': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'lookup_seconds': 0.0
+        }
+
+    def get(self, key):
+        started = time.perf_counter()
+        value = self._get(key)
+        with self._lock:
+            self.stats['hits' if value is not None else 'misses'] += 1
+            self.stats['lookup_seconds'] += time.perf_counter() - started
+        return value
+
+    def set(self, key, value):
+        self._set(key, value)
+        with self._lock:
+            self.stats['sets'] += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        stats['entries'] = len(self)
+        return stats
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+class MemoryResponseCache(ResponseCache):
+    """Size-bounded LRU with per-entry TTL, held in process memory"""
+
+    def __init__(self, max_entries=1000, ttl=3600):
+        super().__init__(max_entries, ttl)
+        self._entries = OrderedDict()
+        self._entries_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key):
+        with self._entries_lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._count('expirations')
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key, value):
+        with self._entries_lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._count('evictions')
+
+class SQLiteResponseCache(ResponseCache):
+    """LRU + TTL cache stored in a SQLite file so it survives restarts"""
+
+    def __init__(self, path, max_entries=10000, ttl=86400):
+        super().__init__(max_entries, ttl)
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS response_cache ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS ix_response_cache_accessed_at ON response_cache (accessed_at)')
+        self._db_lock = threading.Lock()
+
+    def __len__(self):
+        with self._db_lock:
+            return self._conn.execute('SELECT COUNT(*) FROM response_cache').fetchone()[0]
+
+    def _get(self, key):
+        now = time.time()
+        with self._db_lock:
+            row = self._conn.execute('SELECT value, expires_at FROM response_cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute('DELETE FROM response_cache WHERE key = ?', (key,))
+                self._count('expirations')
+                return None
+            self._conn.execute('UPDATE response_cache SET accessed_at = ? WHERE key = ?', (now, key))
+            return row[0]
+
+    def _set(self, key, value):
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO response_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, value, now + self.ttl, now)
+            )
+            overflow = self._conn.execute('SELECT COUNT(*) FROM response_cache').fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    'DELETE FROM response_cache WHERE key IN '
+                    '(SELECT key FROM response_cache ORDER BY accessed_at LIMIT ?)', (overflow,)
+                )
+                self._count('evictions', overflow)
+
+def build_response_cache():
+    """Create the cache configured by GPT_CACHE_* environment variables"""
+    backend = os.getenv('GPT_CACHE_BACKEND', 'memory').lower()
+    max_entries = int(os.getenv('GPT_CACHE_SIZE', 1000))
+    ttl = int(os.getenv('GPT_CACHE_TTL', 3600))
+    if backend == 'sqlite':
+        return SQLiteResponseCache(os.getenv('GPT_CACHE_PATH', 'response_cache.db'), max_entries, ttl)
+    if backend == 'memory':
+        return MemoryResponseCache(max_entries, ttl)
+    return None
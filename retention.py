@@ -0,0 +1,401 @@
+import gzip
+import json
+import os
+import tempfile
+import time
+from array import array
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from operator import itemgetter
+from sqlalchemy import func, or_
+from models import db, UserBehavior, BehaviorDailyRollup, JobState
+from storage import insert_ignore
+from instrumentation import get_logger
+
+log = get_logger('retention')
+
+# Fields of an archived event, in file order
+ARCHIVE_COLUMNS = ('id', 'user_id', 'session_id', 'action', 'product_id', 'timestamp', 'data')
+
+# Encoded lines handed to the compressor at a time
+WRITE_BUFFER_LINES = 1000
+
+_encode = json.JSONEncoder(separators=(',', ':')).encode
+
+# JobState row used as a lease so only one process archives at a time
+LEASE_NAME = 'behavior_retention'
+
+class BehaviorArchive:
+    """
+    Archived UserBehavior rows as gzip-compressed JSON lines, one directory
+    per day. Files are never modified: each archival run adds a new part,
+    written under a temporary name and renamed into place once synced, so a
+    crash can leave a stray temporary file but never a half-written part.
+    Without a path (BEHAVIOR_ARCHIVE_DIR unset) the archive is empty and
+    cannot be written.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('BEHAVIOR_ARCHIVE_DIR') or None
+
+    @property
+    def configured(self):
+        return self.path is not None
+
+    def days(self, start=None, end=None):
+        """Archived days in [start, end), oldest first"""
+        if not self.configured or not os.path.isdir(self.path):
+            return []
+        days = []
+        for name in os.listdir(self.path):
+            try:
+                day = date.fromisoformat(name)
+            except ValueError:
+                continue
+            if (start is None or day >= start) and (end is None or day < end):
+                days.append(day)
+        return sorted(days)
+
+    def parts(self, day):
+        if not self.configured:
+            return []
+        directory = self._directory(day)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.jsonl.gz'))
+
+    def read(self, day):
+        """Yield every archived event of `day` as a dict"""
+        for path in self.parts(day):
+            with gzip.open(path, 'rt', encoding='utf-8') as lines:
+                for line in lines:
+                    yield json.loads(line)
+
+    def write(self, day, rows):
+        """Write event dicts as a new part for `day`; returns its path, or None if there were no rows"""
+        if not self.configured:
+            raise RuntimeError("No archive directory; set BEHAVIOR_ARCHIVE_DIR")
+        directory = self._directory(day)
+        os.makedirs(directory, exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=directory, prefix='.part-', suffix='.tmp')
+        first_id = last_id = None
+        try:
+            with os.fdopen(handle, 'wb') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as out:
+                    lines = []
+                    for row in rows:
+                        lines.append(_encode(row))
+                        first_id = row['id'] if first_id is None else min(first_id, row['id'])
+                        last_id = row['id'] if last_id is None else max(last_id, row['id'])
+                        if len(lines) >= WRITE_BUFFER_LINES:
+                            out.write(('\n'.join(lines) + '\n').encode('utf-8'))
+                            lines = []
+                    if lines:
+                        out.write(('\n'.join(lines) + '\n').encode('utf-8'))
+                raw.flush()
+                os.fsync(raw.fileno())
+            if first_id is None:
+                os.remove(temporary)
+                return None
+            path = os.path.join(directory, f"part-{first_id:012d}-{last_id:012d}.jsonl.gz")
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        _sync_directory(directory)
+        return path
+
+    def size(self):
+        """Bytes on disk across all parts"""
+        return sum(os.path.getsize(path) for day in self.days() for path in self.parts(day))
+
+    def _directory(self, day):
+        return os.path.join(self.path, day.isoformat())
+
+class BehaviorRetention:
+    """
+    Keeps UserBehavior to the last `hot_days` days. Older days move out one
+    at a time, oldest first: the day's rows go to a new archive part, its
+    BehaviorDailyRollup rows are recomputed from everything archived for it,
+    and only then are the archived rows deleted, in short transactions so
+    ingest is never held up for long. Every step is safe to repeat after a
+    crash: rows already in the archive are not written again, and the daily
+    rollup is replaced rather than added to.
+    """
+
+    def __init__(self, archive=None, hot_days=None, batch_size=None, pause=None, chunk_size=10000,
+                 lease_seconds=3600):
+        self.archive = archive or BehaviorArchive()
+        self.hot_days = hot_days or int(os.getenv('BEHAVIOR_HOT_DAYS', 30))
+        self.batch_size = batch_size or int(os.getenv('BEHAVIOR_PRUNE_BATCH', 1000))
+        # Seconds between delete batches, so other writers get the database in between
+        self.pause = pause if pause is not None else float(os.getenv('BEHAVIOR_PRUNE_PAUSE', 0.05))
+        self.chunk_size = chunk_size
+        self.lease_seconds = lease_seconds
+        self.last_run = None
+
+    def cutoff(self, now=None):
+        """Start of the oldest day kept in the hot table"""
+        now = now or datetime.utcnow()
+        return (now - timedelta(days=self.hot_days)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def run(self, now=None):
+        """
+        Archive and prune every day before the cutoff. Returns a summary, or
+        None if another run is active or no archive directory is configured.
+        """
+        if not self.archive.configured:
+            log.warning("retention_skipped", reason="BEHAVIOR_ARCHIVE_DIR is not set")
+            return None
+        cutoff = self.cutoff(now)
+        token = self._acquire()
+        if token is None:
+            log.info("retention_skipped", reason="lease held elsewhere")
+            return None
+        summary = {'cutoff': cutoff.isoformat(), 'days': 0, 'archived': 0, 'pruned': 0}
+        try:
+            while True:
+                oldest = db.session.query(func.min(UserBehavior.timestamp)).scalar()
+                if oldest is None or oldest >= cutoff:
+                    break
+                result = self.archive_day(oldest.date())
+                summary['days'] += 1
+                summary['archived'] += result['archived']
+                summary['pruned'] += result['pruned']
+                token = self._renew(token)
+                if not result['pruned'] or token is None:
+                    break
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            if token is not None:
+                self._release(token)
+        self.last_run = summary
+        log.info("retention_finished", **summary)
+        return summary
+
+    def archive_day(self, day):
+        """Move one day of events from the hot table to the archive and the daily rollup"""
+        start = datetime(day.year, day.month, day.day)
+        counts = defaultdict(int)
+        sessions = defaultdict(set)
+        already_archived = set()
+        for row in self.archive.read(day):
+            already_archived.add(row['id'])
+            _count(counts, sessions, row)
+
+        archived_ids = array('q')
+        written = 0
+
+        def new_rows():
+            nonlocal written
+            for row in self._hot_day_query(start, start + timedelta(days=1)).yield_per(self.chunk_size):
+                archived_ids.append(row.id)
+                if row.id in already_archived:
+                    continue
+                event = {
+                    'id': row.id,
+                    'user_id': row.user_id,
+                    'session_id': row.session_id,
+                    'action': row.action,
+                    'product_id': row.product_id,
+                    'timestamp': row.timestamp.isoformat(),
+                    'data': row.data
+                }
+                _count(counts, sessions, event)
+                written += 1
+                yield event
+
+        part = self.archive.write(day, new_rows())
+        db.session.rollback()
+
+        # Replaced as a whole: the counts cover every part archived for the day
+        db.session.query(BehaviorDailyRollup).filter(BehaviorDailyRollup.day == day).delete(synchronize_session=False)
+        if counts:
+            db.session.execute(BehaviorDailyRollup.__table__.insert(), [
+                {'day': day, 'action': action, 'product_id': product_id,
+                 'events': events, 'sessions': len(sessions[(action, product_id)])}
+                for (action, product_id), events in counts.items()
+            ])
+        db.session.commit()
+
+        pruned = self._prune(archived_ids)
+        result = {'day': day.isoformat(), 'archived': written, 'pruned': pruned, 'part': part}
+        log.info("day_archived", **result)
+        return result
+
+    def events(self, start=None, end=None, columns=('session_id', 'action', 'product_id'), chunk_size=100000):
+        """
+        Yield lists of row tuples for events in [start, end), archived days
+        first, then the hot table. A row caught between being archived and
+        being pruned is returned once.
+        """
+        unknown = set(columns) - set(ARCHIVE_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown event columns: {', '.join(sorted(unknown))}")
+        getters = [_archived_timestamp if column == 'timestamp' else itemgetter(column) for column in columns]
+        oldest_hot = db.session.query(func.min(UserBehavior.timestamp)).scalar()
+
+        last_day = (end - timedelta(microseconds=1)).date() + timedelta(days=1) if end is not None else None
+        overlap = set()
+        for day in self.archive.days(start.date() if start is not None else None, last_day):
+            day_start = datetime(day.year, day.month, day.day)
+            whole_day = (start is None or day_start >= start) and (end is None or day_start + timedelta(days=1) <= end)
+            track = oldest_hot is not None and day >= oldest_hot.date()
+            chunk = []
+            for row in self.archive.read(day):
+                if track:
+                    overlap.add(row['id'])
+                if not whole_day:
+                    timestamp = _archived_timestamp(row)
+                    if (start is not None and timestamp < start) or (end is not None and timestamp >= end):
+                        continue
+                chunk.append(tuple(getter(row) for getter in getters))
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+        query = db.session.query(*[getattr(UserBehavior, column) for column in columns])
+        if overlap:
+            query = query.add_columns(UserBehavior.id)
+        if start is not None:
+            query = query.filter(UserBehavior.timestamp >= start)
+        if end is not None:
+            query = query.filter(UserBehavior.timestamp < end)
+        result = db.session.connection().execution_options(stream_results=True).execute(query.statement)
+        for chunk in result.partitions(chunk_size):
+            if overlap:
+                chunk = [tuple(row[:-1]) for row in chunk if row[-1] not in overlap]
+            if chunk:
+                yield chunk
+
+    def daily(self, start=None, end=None, action=None, product_id=None):
+        """
+        Events and distinct sessions per day, action and product for days in
+        [start, end): from BehaviorDailyRollup for archived days, grouped from
+        the hot table for the rest.
+        """
+        rollup = db.session.query(
+            BehaviorDailyRollup.day, BehaviorDailyRollup.action, BehaviorDailyRollup.product_id,
+            BehaviorDailyRollup.events, BehaviorDailyRollup.sessions
+        )
+        day = func.date(UserBehavior.timestamp)
+        product = func.coalesce(UserBehavior.product_id, 0)
+        hot = db.session.query(
+            day, UserBehavior.action, product, func.count(UserBehavior.id),
+            func.count(func.distinct(UserBehavior.session_id))
+        ).group_by(day, UserBehavior.action, product)
+        if start is not None:
+            rollup = rollup.filter(BehaviorDailyRollup.day >= start)
+            hot = hot.filter(UserBehavior.timestamp >= datetime(start.year, start.month, start.day))
+        if end is not None:
+            rollup = rollup.filter(BehaviorDailyRollup.day < end)
+            hot = hot.filter(UserBehavior.timestamp < datetime(end.year, end.month, end.day))
+        if action is not None:
+            rollup = rollup.filter(BehaviorDailyRollup.action == action)
+            hot = hot.filter(UserBehavior.action == action)
+        if product_id is not None:
+            rollup = rollup.filter(BehaviorDailyRollup.product_id == product_id)
+            hot = hot.filter(product == product_id)
+
+        rows = [tuple(row) for row in rollup.all()]
+        # A day part-way through archival reports what has been archived so far
+        archived_days = {row[0] for row in rows}
+        for row in hot.all():
+            row_day = row[0] if isinstance(row[0], date) else date.fromisoformat(row[0])
+            if row_day not in archived_days:
+                rows.append((row_day, *row[1:]))
+        rows.sort(key=lambda row: (row[0], row[1], row[2]))
+        return [
+            {'day': row_day.isoformat(), 'action': row_action, 'product_id': row_product,
+             'events': events, 'sessions': session_count}
+            for row_day, row_action, row_product, events, session_count in rows
+        ]
+
+    def get_stats(self):
+        days = self.archive.days()
+        return {
+            'hot_days': self.hot_days,
+            'cutoff': self.cutoff().isoformat(),
+            'oldest_hot_event': _isoformat(db.session.query(func.min(UserBehavior.timestamp)).scalar()),
+            'archived_days': len(days),
+            'oldest_archived_day': days[0].isoformat() if days else None,
+            'archive_bytes': self.archive.size(),
+            'last_run': self.last_run
+        }
+
+    def export_query(self, day):
+        """Build the scan behind archive_day"""
+        start = datetime(day.year, day.month, day.day)
+        return self._hot_day_query(start, start + timedelta(days=1))
+
+    def _hot_day_query(self, start, end):
+        return db.session.query(
+            UserBehavior.id, UserBehavior.user_id, UserBehavior.session_id, UserBehavior.action,
+            UserBehavior.product_id, UserBehavior.timestamp, UserBehavior.data
+        ).filter(UserBehavior.timestamp >= start, UserBehavior.timestamp < end)
+
+    def _prune(self, ids):
+        pruned = 0
+        for offset in range(0, len(ids), self.batch_size):
+            batch = ids[offset:offset + self.batch_size].tolist()
+            pruned += db.session.query(UserBehavior).filter(UserBehavior.id.in_(batch)).delete(synchronize_session=False)
+            db.session.commit()
+            if self.pause:
+                time.sleep(self.pause)
+        return pruned
+
+    def _acquire(self):
+        """Take the retention lease; the returned token is the lease's updated_at"""
+        now = datetime.utcnow()
+        insert_ignore(db.session, JobState, {'name': LEASE_NAME}, {'value': 0, 'updated_at': now})
+        taken = db.session.query(JobState).filter(
+            JobState.name == LEASE_NAME,
+            or_(JobState.value == 0, JobState.updated_at < now - timedelta(seconds=self.lease_seconds))
+        ).update({JobState.value: 1, JobState.updated_at: now}, synchronize_session=False)
+        db.session.commit()
+        return now if taken else None
+
+    def _renew(self, token):
+        now = datetime.utcnow()
+        renewed = db.session.query(JobState).filter(
+            JobState.name == LEASE_NAME, JobState.value == 1, JobState.updated_at == token
+        ).update({JobState.updated_at: now}, synchronize_session=False)
+        db.session.commit()
+        if not renewed:
+            log.warning("retention_lease_lost")
+        return now if renewed else None
+
+    def _release(self, token):
+        db.session.query(JobState).filter(
+            JobState.name == LEASE_NAME, JobState.updated_at == token
+        ).update({JobState.value: 0}, synchronize_session=False)
+        db.session.commit()
+
+def _count(counts, sessions, event):
+    key = (event['action'], event['product_id'] or 0)
+    counts[key] += 1
+    sessions[key].add(event['session_id'])
+
+def _archived_timestamp(row):
+    return datetime.fromisoformat(row['timestamp'])
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+def _sync_directory(path):
+    """Make a rename in `path` durable where the platform allows it"""
+    try:
+        descriptor = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(descriptor)
+    except OSError:
+        pass
+    finally:
+        os.close(descriptor)
@@ -1,68 +1,228 @@
 import os
-from twilio.rest import Client
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from twilio.base.exceptions import TwilioRestException
 from dotenv import load_dotenv
+from instrumentation import SMS_SECONDS, get_logger
 
 load_dotenv()
 
+log = get_logger('sms')
+
+# Twilio answers these with "try again later" semantics
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` operations per second"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class SMSResult:
+    """Outcome of sending one message"""
+
+    def __init__(self, recipient, success, sid=None, error=None, attempts=0, elapsed=0.0, retryable=False):
+        self.recipient = recipient
+        self.success = success
+        self.sid = sid
+        self.error = error
+        self.attempts = attempts
+        self.elapsed = elapsed
+        # Whether a later attempt could succeed (rate limits, provider outages)
+        self.retryable = retryable
+
+    def to_dict(self):
+        return {
+            'recipient': self.recipient,
+            'success': self.success,
+            'sid': self.sid,
+            'error': self.error,
+            'attempts': self.attempts
+        }
+
+class FakeTwilioClient:
+    """Offline stand-in for twilio.rest.Client, for benchmarks and local runs"""
+
+    def __init__(self, latency=0.05, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.messages = self
+        self.sent = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def create(self, body, from_, to):
+        time.sleep(self.latency)
+        with self._lock:
+            if self._random.random() < self.failure_rate:
+                raise TwilioRestException(status=503, uri='/Messages', msg='Service unavailable')
+            self.sent.append((to, body, time.monotonic()))
+            sid = f"SMfake{len(self.sent):08d}"
+        return type('FakeMessage', (), {'sid': sid})()
+
 class SMSSender:
-    def __init__(self):
+    def __init__(self, client=None, rate_limit=None, max_workers=None, max_retries=3, backoff=0.5):
         self.account_sid = os.getenv('TWILIO_ACCOUNT_SID')
         self.auth_token = os.getenv('TWILIO_AUTH_TOKEN')
         self.from_number = os.getenv('TWILIO_PHONE_NUMBER')
-        
-        if self.account_sid and self.auth_token:
-            self.client = Client(self.account_sid, self.auth_token)
-        else:
-            self.client = None
-            print("Warning: Twilio credentials not configured. SMS functionality disabled.")
-    
+        self.rate_limit = rate_limit or float(os.getenv('SMS_RATE_LIMIT', 10))
+        self.max_workers = max_workers or int(os.getenv('SMS_MAX_WORKERS', 8))
+        self.max_retries = max_retries
+        self.backoff = backoff
+        # Seconds before a Twilio request is abandoned; keep it well below OUTBOUND_LEASE_SECONDS
+        self.timeout = float(os.getenv('SMS_TIMEOUT', 15))
+
+        self._client = client
+        self._client_lock = threading.Lock()
+        if client is None and not (self.account_sid and self.auth_token):
+            log.warning("sms_disabled", reason="Twilio credentials not configured")
+
+    @property
+    def client(self):
+        """The Twilio client, created on the first send; None without credentials"""
+        if self._client is None and self.account_sid and self.auth_token:
+            with self._client_lock:
+                if self._client is None:
+                    from twilio.rest import Client
+                    from twilio.http.http_client import TwilioHttpClient
+                    self._client = Client(self.account_sid, self.auth_token,
+                                          http_client=TwilioHttpClient(timeout=self.timeout))
+        return self._client
+
     def send_sms(self, to_number, message):
         """Send SMS message to specified number"""
+        return self.send_message(to_number, message).success
+
+    def send_message(self, to_number, message):
+        """Make one send attempt and return an SMSResult saying whether a retry could help"""
         if not self.client:
-            print(f"SMS would be sent to {to_number}: {message}")
-            return False
-        
+            log.info("sms_not_configured", to=to_number, body=message)
+            return SMSResult(to_number, False, error='SMS not configured')
+
+        started = time.perf_counter()
         try:
-            # Ensure phone number is in proper format
-            if not to_number.startswith('+'):
-                to_number = '+1' + to_number.replace('-', '').replace(' ', '')
-            
+            to_number = self._format_number(to_number)
             message_obj = self.client.messages.create(
                 body=message,
                 from_=self.from_number,
                 to=to_number
             )
-            
-            print(f"SMS sent successfully to {to_number}. SID: {message_obj.sid}")
-            return True
-            
+
+            elapsed = time.perf_counter() - started
+            SMS_SECONDS.observe(elapsed, outcome='ok')
+            log.info("sms_sent", to=to_number, sid=message_obj.sid, seconds=round(elapsed, 4))
+            return SMSResult(to_number, True, sid=message_obj.sid, attempts=1, elapsed=elapsed)
+
         except Exception as e:
-            print(f"Error sending SMS to {to_number}: {e}")
-            return False
-    
+            elapsed = time.perf_counter() - started
+            SMS_SECONDS.observe(elapsed, outcome='error')
+            log.warning("sms_failed", to=to_number, error=str(e))
+            return SMSResult(to_number, False, error=str(e), attempts=1, elapsed=elapsed,
+                             retryable=self._is_transient(e))
+
     def send_bulk_sms(self, recipients, message):
         """Send SMS to multiple recipients"""
-        results = []
-        for recipient in recipients:
-            success = self.send_sms(recipient, message)
-            results.append({
-                'recipient': recipient,
-                'success': success
-            })
-        return results
-    
+        return [result.to_dict() for result in self.dispatch_bulk(recipients, message)]
+
+    def dispatch_bulk(self, recipients, message, max_workers=None, rate_limit=None):
+        """
+        Send one message to many recipients from a worker pool, throttled by a
+        token bucket. Returns one SMSResult per recipient, in input order.
+        """
+        if not self.client:
+            log.info("sms_not_configured", recipients=len(recipients), body=message)
+            return [SMSResult(recipient, False, error='SMS not configured') for recipient in recipients]
+
+        bucket = TokenBucket(rate_limit or self.rate_limit)
+        with ThreadPoolExecutor(max_workers=max_workers or self.max_workers) as executor:
+            return list(executor.map(lambda recipient: self._send_with_retry(recipient, message, bucket), recipients))
+
+    def _send_with_retry(self, recipient, message, bucket):
+        started = time.perf_counter()
+        attempts = 0
+        while True:
+            attempts += 1
+            bucket.acquire()
+            attempt_started = time.perf_counter()
+            try:
+                message_obj = self.client.messages.create(
+                    body=message,
+                    from_=self.from_number,
+                    to=self._format_number(recipient)
+                )
+                SMS_SECONDS.observe(time.perf_counter() - attempt_started, outcome='ok')
+                return SMSResult(recipient, True, sid=message_obj.sid, attempts=attempts,
+                                 elapsed=time.perf_counter() - started)
+            except Exception as e:
+                SMS_SECONDS.observe(time.perf_counter() - attempt_started, outcome='error')
+                if attempts > self.max_retries or not self._is_transient(e):
+                    log.warning("sms_failed", to=recipient, error=str(e), attempts=attempts)
+                    return SMSResult(recipient, False, error=str(e), attempts=attempts,
+                                     elapsed=time.perf_counter() - started)
+                # Exponential backoff with jitter so retries do not arrive in lockstep
+                time.sleep(self.backoff * (2 ** (attempts - 1)) * (0.5 + random.random()))
+
+    def _is_transient(self, error):
+        if isinstance(error, TwilioRestException):
+            return error.status in TRANSIENT_STATUS_CODES
+        import requests
+        return isinstance(error, (ConnectionError, TimeoutError, requests.ConnectionError, requests.Timeout))
+
+    def _format_number(self, to_number):
+        # Ensure phone number is in proper format
+        if not to_number.startswith('+'):
+            to_number = '+1' + to_number.replace('-', '').replace(' ', '')
+        return to_number
+
     def validate_phone_number(self, phone_number):
         """Validate phone number format"""
         if not phone_number:
             return False
-        
+
         # Remove common separators
         clean_number = phone_number.replace('-', '').replace(' ', '').replace('(', '').replace(')', '')
-        
+
         # Check if it's a valid US number
         if clean_number.startswith('+1'):
             clean_number = clean_number[2:]
         elif clean_number.startswith('1'):
             clean_number = clean_number[1:]
-        
-        return len(clean_number) == 10 and clean_number.isdigit() 
\ No newline at end of file
+
+        return len(clean_number) == 10 and clean_number.isdigit()
+
+_shared_sender = None
+_shared_lock = threading.Lock()
+
+def get_sms_sender():
+    """The process-wide SMSSender, created on first use"""
+    global _shared_sender
+    if _shared_sender is None:
+        with _shared_lock:
+            if _shared_sender is None:
+                _shared_sender = SMSSender()
+    return _shared_sender
+
+def set_sms_sender(sender):
+    """Replace the process-wide sender, e.g. with one wrapping FakeTwilioClient"""
+    global _shared_sender
+    with _shared_lock:
+        _shared_sender = sender
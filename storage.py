@@ -0,0 +1,122 @@
+import os
+from functools import lru_cache
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+
+DEFAULT_DATABASE_URI = 'sqlite:///ai_journey.db'
+
+UPSERT_DIALECTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+def database_uri():
+    return os.getenv('DATABASE_URL', DEFAULT_DATABASE_URI)
+
+def sqlite_pragmas():
+    """PRAGMAs applied to every new SQLite connection"""
+    return {
+        'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    }
+
+def engine_options(uri):
+    """SQLAlchemy engine options for the given database URI"""
+    if uri.startswith('sqlite'):
+        return {
+            # Lets the scheduler and ingest threads share the pooled connections
+            'connect_args': {'check_same_thread': False, 'timeout': sqlite_pragmas()['busy_timeout'] / 1000.0}
+        }
+    return {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True
+    }
+
+def configure_database(app):
+    """Set the database URI and engine options; call before db.init_app"""
+    uri = database_uri()
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(uri)
+
+def install_sqlite_pragmas(engine, pragmas=None):
+    """Apply journal mode, synchronous level and busy timeout to each new SQLite connection"""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = pragmas or sqlite_pragmas()
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={pragmas['journal_mode']}")
+        cursor.execute(f"PRAGMA synchronous={pragmas['synchronous']}")
+        cursor.execute(f"PRAGMA busy_timeout={int(pragmas['busy_timeout'])}")
+        cursor.close()
+
+def increment(session, model, key, column, amount, values=None):
+    """
+    Atomically add `amount` to `column` of the row identified by `key`,
+    inserting it when missing. `key` must match a unique constraint and
+    `values` are extra columns set on both insert and update.
+    """
+    values = values or {}
+    dialect = session.get_bind().dialect.name
+    if dialect in UPSERT_DIALECTS:
+        statement = _upsert_statement(dialect, model.__table__, tuple(key), tuple(values), column)
+        session.execute(statement, {column: amount, **key, **values})
+        return
+    updated = session.query(model).filter_by(**key).update(
+        {column: getattr(model, column) + amount, **values}, synchronize_session=False
+    )
+    if not updated:
+        session.add(model(**{column: amount}, **key, **values))
+
+def increment_many(session, model, key_columns, column, rows):
+    """
+    increment() for many rows with one executemany. Each row is a dict of the
+    `key_columns` and the amount to add to `column`; pass rows in a stable
+    order so concurrent writers lock them in the same order.
+    """
+    if not rows:
+        return
+    dialect = session.get_bind().dialect.name
+    if dialect not in UPSERT_DIALECTS:
+        for row in rows:
+            increment(session, model, {name: row[name] for name in key_columns}, column, row[column])
+        return
+    session.execute(_upsert_statement(dialect, model.__table__, tuple(key_columns), (), column), rows)
+
+def upsert(session, model, key, values):
+    """Insert the row identified by `key`, or set `values` on it when it exists"""
+    dialect = session.get_bind().dialect.name
+    if dialect in UPSERT_DIALECTS:
+        session.execute(_upsert_statement(dialect, model.__table__, tuple(key), tuple(values)), {**key, **values})
+        return
+    if not session.query(model).filter_by(**key).update(values, synchronize_session=False):
+        session.add(model(**key, **values))
+
+def insert_ignore(session, model, key, values):
+    """Insert a row unless one with the same unique `key` exists; returns True when inserted"""
+    table = model.__table__
+    insert = UPSERT_DIALECTS.get(session.get_bind().dialect.name)
+    if insert is not None:
+        statement = insert(table).values(**key, **values).on_conflict_do_nothing(index_elements=list(key))
+        return session.execute(statement).rowcount == 1
+    if session.query(model).filter_by(**key).first() is not None:
+        return False
+    session.add(model(**key, **values))
+    return True
+
+@lru_cache(maxsize=None)
+def _upsert_statement(dialect, table, key_columns, set_columns, increment_column=None):
+    """
+    INSERT ... ON CONFLICT DO UPDATE taking every value as an execute()
+    parameter. Built once per shape: constructing the statement (and its
+    `excluded` namespace) costs more than running it.
+    """
+    statement = UPSERT_DIALECTS[dialect](table)
+    excluded = statement.excluded
+    set_ = {name: excluded[name] for name in set_columns}
+    if increment_column is not None:
+        set_[increment_column] = table.c[increment_column] + excluded[increment_column]
+    return statement.on_conflict_do_update(index_elements=list(key_columns), set_=set_)
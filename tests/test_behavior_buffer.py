@@ -0,0 +1,39 @@
+from datetime import datetime
+import pytest
+from models import db, UserBehavior
+from behavior_buffer import BehaviorBuffer
+from journey_engine import InvalidEvent, JourneyEngine
+
+def event(session_id, action='view'):
+    return {'user_id': None, 'session_id': session_id, 'action': action, 'product_id': 1,
+            'timestamp': datetime.utcnow(), 'data': None}
+
+def test_bad_row_does_not_drop_its_batch(app):
+    buffer = BehaviorBuffer(app, batch_size=100, flush_interval=0.05, retry_backoff=0.001)
+    events = [event(f'session-{number}') for number in range(10)]
+    events.insert(4, event('poisoned', action=None))
+    for item in events:
+        assert buffer.put(item)
+    buffer.stop()
+
+    stats = buffer.get_stats()
+    assert stats['flushed'] == 10
+    assert stats['failed'] == 1
+    assert stats['retries'] == 0
+    with app.app_context():
+        stored = {row.session_id for row in UserBehavior.query}
+    assert stored == {f'session-{number}' for number in range(10)}
+
+def test_invalid_event_is_rejected_before_queueing(app):
+    engine = JourneyEngine()
+    buffer = engine.enable_buffering(app, flush_interval=0.05)
+    with app.app_context():
+        with pytest.raises(InvalidEvent):
+            engine.track_behavior(None, 'session-1', None)
+        with pytest.raises(InvalidEvent):
+            engine.track_behavior(None, '', 'view')
+        engine.track_behavior(None, 'session-1', 'view', product_id=1)
+    buffer.stop()
+    assert buffer.get_stats()['enqueued'] == 1
+    with app.app_context():
+        assert db.session.query(UserBehavior).count() == 1
@@ -0,0 +1,26 @@
+import pytest
+from llm_clients import FakeProvider
+from gpt_generator import GPTGenerator
+
+class BrokenStream(FakeProvider):
+    """Streams one chunk, then fails"""
+
+    def _stream(self, system_prompt, message):
+        yield "part0 "
+        raise ConnectionError("stream reset")
+
+def test_stream_error_after_first_chunk_is_raised():
+    generator = GPTGenerator(provider=BrokenStream(latency=0))
+    chunks = []
+    with pytest.raises(ConnectionError):
+        for chunk in generator.generate_stream("hello"):
+            chunks.append(chunk)
+    assert chunks == ["part0 "]
+    assert generator.get_stats()['fallbacks'] == 0
+
+def test_batch_counts_every_provider_call():
+    generator = GPTGenerator(provider=FakeProvider(latency=0.001, max_concurrency=16))
+    jobs = [('product_interest', {'product_name': f'Product {number}'}) for number in range(200)]
+    results = generator.generate_batch(jobs, max_workers=16)
+    assert all(result.ok for result in results)
+    assert generator.get_stats()['provider_calls'] == 200
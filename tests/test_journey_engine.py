@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta
+from models import db, Cart, CartItem
+from journey_engine import JourneyEngine
+
+def add_cart(session_id, updated_at):
+    db.session.add(Cart(session_id=session_id, user_id=None, updated_at=updated_at))
+    db.session.add(CartItem(session_id=session_id, product_id=1, quantity=1, updated_at=updated_at))
+    db.session.commit()
+
+def reminded_sessions(engine):
+    sent = []
+    engine._send_due_reminders = lambda carts: sent.extend(cart.session_id for cart in carts)
+    return sent
+
+def test_abandoned_cart_cutoff_survives_a_restart(app):
+    with app.app_context():
+        first = JourneyEngine()
+        reminded_sessions(first)
+        first.check_abandoned_carts()
+        cutoff = first.idle_cutoff
+
+        # Idle before the persisted cutoff: the earlier process already handled it
+        add_cart('handled', cutoff - timedelta(minutes=1))
+        add_cart('new', cutoff + timedelta(seconds=30))
+
+        restarted = JourneyEngine(abandon_after=timedelta(minutes=4))
+        sent = reminded_sessions(restarted)
+        restarted.check_abandoned_carts()
+        assert sent == ['new']
+        assert restarted.idle_cutoff > cutoff
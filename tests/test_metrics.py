@@ -0,0 +1,22 @@
+from datetime import datetime, timedelta
+from models import db, UserBehavior, BehaviorRollup
+import metrics
+
+def test_rebuilt_rollups_share_keys_with_live_writes(app):
+    now = datetime.utcnow()
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    with app.app_context():
+        db.session.execute(UserBehavior.__table__.insert(), [
+            {'session_id': 's1', 'action': 'view', 'product_id': 1, 'timestamp': now},
+            {'session_id': 's2', 'action': 'view', 'product_id': 1, 'timestamp': now},
+            {'session_id': 's3', 'action': 'view', 'product_id': None, 'timestamp': now - timedelta(hours=2)},
+        ])
+        db.session.commit()
+        metrics.rebuild_rollups()
+
+        metrics.record_behaviors([{'action': 'view', 'product_id': 1, 'timestamp': now}])
+        db.session.commit()
+
+        rows = {(row.hour, row.action, row.product_id): row.count for row in BehaviorRollup.query}
+        assert rows == {(hour, 'view', 1): 3, (hour - timedelta(hours=2), 'view', 0): 1}
+        assert metrics.behavior_summary(hours=1)['events_by_action'] == {'view': 3}